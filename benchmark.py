@@ -0,0 +1,175 @@
+# This script benchmarks TinySMPC's core protocols, so that we can track their
+# performance over time (and catch regressions), and size deployments.
+#
+# For each protocol, and each combination of:
+#   - the number of parties (2 to 16)
+#   - the ring (the int64 ring, or a prime ring)
+#   - the inputs (small integers, or fixed-point encoded floats)
+#   - the batch size (for the SharedTensor versions of the protocols)
+# it measures the latency of one call (median and min), the throughput (elements per second),
+# and the communication cost of one call (rounds, messages, and bytes, see profiler.py).
+#
+#   python benchmark.py                              # Run all benchmarks, and print a table
+#   python benchmark.py --parties 2 4 --out new.json # Run some benchmarks, and save the results as JSON
+#   python benchmark.py --baseline old.json          # Compare against saved results (exits with 1 on regressions,
+#                                                    # or on results that aren't in the baseline)
+#
+# The inputs are generated from a fixed seed (--seed), so every run measures the same computation.
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from random import Random
+from statistics import median
+from subprocess import DEVNULL, check_output
+from time import perf_counter
+import json
+import platform
+import sys
+
+from tinysmpc import PrivateScalar, PrivateTensor, VirtualMachine
+from tinysmpc.finite_ring import np
+from tinysmpc.fixed_point import fixed_point
+from tinysmpc.opening import open_shares
+from tinysmpc.profiler import Profiler
+from tinysmpc.secret_sharing import n_from_shares, n_to_shares, tensor_from_shares, tensor_to_shares
+from tinysmpc.shared_addition import add_2sh, add_sh_pub
+from tinysmpc.shared_multiplication import mult_2sh, mult_2tsh, mult_sh_pub
+
+RINGS = {'int64': None, 'prime': 2**61 - 1}  # (The prime ring is small enough for comparisons)
+INPUTS = ('int', 'fixed')
+KEY = ('op', 'parties', 'ring', 'input', 'batch')  # The fields that identify a benchmark
+
+def scalar_benchmarks(machines, Q, x, y, exponent):
+    '''Returns {op name: function to time} for the SharedScalar protocols, on inputs x and y.'''
+    x_sh, y_sh = PrivateScalar(x, machines[0]).share(machines, Q), PrivateScalar(y, machines[-1]).share(machines, Q)
+    benchmarks = {
+        'n_to_shares':   lambda: n_to_shares(x, machines, Q),
+        'n_from_shares': lambda: n_from_shares(x_sh.shares, machines[0], Q),
+        'open_shares':   lambda: open_shares(x_sh.shares, Q),
+        'add_2sh':       lambda: add_2sh(x_sh, y_sh),
+        'add_sh_pub':    lambda: add_sh_pub(x_sh, y),
+        'mult_2sh':      lambda: mult_2sh(x_sh, y_sh),
+        'mult_sh_pub':   lambda: mult_sh_pub(x_sh, y),
+        f'pow_{exponent}': lambda: x_sh ** exponent,
+    }
+    if len(machines) == 2 and (Q is None or Q <= 2**63): benchmarks['greater_than'] = lambda: x_sh > y
+    return benchmarks
+
+def tensor_benchmarks(machines, Q, xs, ys, exponent):
+    '''Returns {op name: function to time} for the SharedTensor protocols, on input arrays xs and ys.'''
+    x_sh, y_sh = PrivateTensor(xs, machines[0]).share(machines, Q), PrivateTensor(ys, machines[-1]).share(machines, Q)
+    benchmarks = {
+        'tensor_to_shares':   lambda: tensor_to_shares(xs, machines, Q),
+        'tensor_from_shares': lambda: tensor_from_shares(x_sh.shares, machines[0], Q),
+        'open_shares':        lambda: open_shares(x_sh.shares, Q),
+        'add_2sh':            lambda: add_2sh(x_sh, y_sh),
+        'add_sh_pub':         lambda: add_sh_pub(x_sh, ys),
+        'mult_2tsh':          lambda: mult_2tsh(x_sh, y_sh),
+        'mult_sh_pub':        lambda: mult_sh_pub(x_sh, ys),
+        f'pow_{exponent}':    lambda: x_sh ** exponent,
+    }
+    if len(machines) == 2 and (Q is None or Q <= 2**63): benchmarks['greater_than'] = lambda: x_sh > ys
+    return benchmarks
+
+def measure(fn, min_time=0.2, max_repeats=1000):
+    '''Call fn (after one warm-up call) until min_time seconds have passed, and return the time of each call.'''
+    fn()
+    times = []
+    while not times or (sum(times) < min_time and len(times) < max_repeats):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return times
+
+def costs(fn):
+    '''Returns the communication cost of one call of fn: its rounds, messages, and bytes.'''
+    with Profiler() as profiler: fn()
+    totals = profiler.totals()
+    return {'rounds': totals['rounds'], 'sends': totals['sends'], 'bytes': totals['bytes']}
+
+def make_input(rng, kind, Q):
+    '''Returns a random input value: a small integer, or a fixed-point float (in the ring).'''
+    value = rng.randint(-1000, 1000) if kind == 'int' else fixed_point(rng.uniform(-10, 10))
+    return value if Q is None else value % Q
+
+def run_benchmarks(parties=(2, 4, 8, 16), rings=tuple(RINGS), inputs=INPUTS, batch_sizes=(1000,),
+                   exponent=8, min_time=0.2, seed=0, verbose=False):
+    '''Run all combinations of benchmarks, and return a list of results (one dict per benchmark).'''
+    rng = Random(seed)
+    results = []
+    for n_parties in parties:
+        machines = [VirtualMachine(f'party {i}') for i in range(n_parties)]
+        for ring in rings:
+            Q = RINGS[ring]
+            for kind in inputs:
+                configs = [(1, scalar_benchmarks(machines, Q, make_input(rng, kind, Q), make_input(rng, kind, Q), exponent))]
+                for batch in (batch_sizes if np is not None else []):
+                    xs, ys = ([make_input(rng, kind, Q) for _ in range(batch)] for _ in range(2))
+                    xs, ys = (np.array(values, dtype=object if Q is not None and Q > 2**62 else np.int64) for values in (xs, ys))
+                    configs.append((batch, tensor_benchmarks(machines, Q, xs, ys, exponent)))
+                for batch, benchmarks in configs:
+                    for op, fn in benchmarks.items():
+                        times = measure(fn, min_time)
+                        result = {'op': op, 'parties': n_parties, 'ring': ring, 'input': kind, 'batch': batch,
+                                  'repeats': len(times), 'latency_s': median(times), 'latency_min_s': min(times),
+                                  'throughput_per_s': batch / median(times), **costs(fn)}
+                        results.append(result)
+                        if verbose: print(format_row(result), file=sys.stderr)
+    return results
+
+def compare(results, baseline, tolerance=0.2):
+    '''Compare results against baseline results (by their median latency).
+       Returns a list of (result, ratio of new / baseline latency), the list of regressions (ratio > 1 + tolerance),
+       and the list of results that aren't in the baseline (e.g. new or renamed benchmarks, or the wrong baseline).'''
+    baseline_of = {tuple(result[k] for k in KEY): result for result in baseline}
+    ratios = [(result, result['latency_s'] / baseline_of[key]['latency_s'])
+              for result in results for key in [tuple(result[k] for k in KEY)] if key in baseline_of]
+    regressions = [(result, ratio) for result, ratio in ratios if ratio > 1 + tolerance]
+    unmatched = [result for result in results if tuple(result[k] for k in KEY) not in baseline_of]
+    return ratios, regressions, unmatched
+
+def metadata():
+    '''Returns information about this run, so that results from different machines/commits can be told apart.'''
+    try: commit = check_output(['git', 'rev-parse', 'HEAD'], stderr=DEVNULL, text=True).strip()
+    except Exception: commit = None
+    return {'time': datetime.now(timezone.utc).isoformat(), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__ if np is not None else None, 'platform': platform.platform(), 'cpu': platform.processor()}
+
+def format_row(result, ratio=None):
+    key = f'{result["op"]:<20} parties={result["parties"]:<3} ring={result["ring"]:<6} input={result["input"]:<6} batch={result["batch"]:<6}'
+    row = f'{key} {result["latency_s"] * 1000:10.3f} ms {result["throughput_per_s"]:14.1f}/s {result["rounds"]:4} rounds {result["bytes"]:10} bytes'
+    return row if ratio is None else f'{row} {ratio:6.2f}x'
+
+def main(argv=None):
+    parser = ArgumentParser(description='Benchmark TinySMPC\'s core protocols.')
+    parser.add_argument('--parties', type=int, nargs='+', default=[2, 4, 8, 16])
+    parser.add_argument('--rings', nargs='+', choices=list(RINGS), default=list(RINGS))
+    parser.add_argument('--inputs', nargs='+', choices=INPUTS, default=list(INPUTS))
+    parser.add_argument('--batch-sizes', type=int, nargs='*', default=[1000], help='for the SharedTensor benchmarks (none to skip them)')
+    parser.add_argument('--exponent', type=int, default=8, help='for the __pow__ benchmarks')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds to spend measuring each benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='save the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='latency increase (vs. the baseline) that counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.parties, args.rings, args.inputs, args.batch_sizes, args.exponent, args.min_time, args.seed, verbose=True)
+    if args.out:
+        with open(args.out, 'w') as f: json.dump({'metadata': metadata(), 'results': results}, f, indent=1)
+
+    if not args.baseline:
+        for result in results: print(format_row(result))
+        return 0
+    with open(args.baseline) as f: baseline = json.load(f)['results']
+    ratios, regressions, unmatched = compare(results, baseline, args.tolerance)
+    for result, ratio in ratios: print(format_row(result, ratio))
+    print(f'\n{len(regressions)} regressions (of {len(ratios)} benchmarks compared, tolerance {args.tolerance:.0%})')
+    for result, ratio in regressions: print(format_row(result, ratio))
+    if unmatched:
+        print(f'\n{len(unmatched)} benchmarks are not in the baseline, so they were not compared')
+        for result in unmatched: print(format_row(result))
+    return 1 if regressions or unmatched else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from .tinysmpc import VirtualMachine, PrivateScalar, SharedScalar
+from .tinysmpc import VirtualMachine, PrivateScalar, SharedScalar, PrivateTensor, SharedTensor, SharedFixed
 
-__all__ = ['VirtualMachine', 'PrivateScalar', 'SharedScalar']
+__all__ = ['VirtualMachine', 'PrivateScalar', 'SharedScalar', 'PrivateTensor', 'SharedTensor', 'SharedFixed']
 __title__ = 'tinysmpc'
\ No newline at end of file
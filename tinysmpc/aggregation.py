@@ -0,0 +1,133 @@
+# This module defines secure aggregation: summing (or averaging) values that are
+# contributed by many data owners, without anyone seeing the individual values.
+#
+# With the basic API, each contribution would be a PrivateScalar, which is shared with
+# .share(), and added to the total with +. That creates a few Python objects per
+# contribution, on every machine, and takes about as long as a multiplication.
+#
+# A SecureAggregator streams the contributions instead:
+#   - It reads them lazily from any iterable (e.g. a generator, or a file), chunk_size
+#     at a time, so the inputs never have to fit in memory.
+#   - Each chunk of contributions is split into random shares all at once (like a
+#     TensorShare, see secret_sharing.py), and each machine adds up its shares of the
+#     whole chunk into its running total. So each machine only stores one Share,
+#     however many contributions there are.
+#   - Nothing is opened, except the sum at the end (or running sums, or the sums of
+#     windows of contributions, if you ask for them).
+#
+#   aggregator = SecureAggregator([alice, bob, charlie])
+#   aggregator.add(value for value in huge_file)
+#   aggregator.open()  # The sum of all of the contributions
+#
+# It works in the int64 ring (where the sum wraps around like an int64), or a prime ring.
+
+from .finite_ring import MAX_INT64, assert_is_array_element, from_ring_array, np, ring_dtype, to_ring_array
+from .profiler import profiled
+from .secret_sharing import Share, split_array
+from itertools import islice
+
+CHUNK_SIZE = 2**16  # Contributions per chunk (which bounds the memory used)
+
+class SecureAggregator():
+    '''Sums a stream of contributions into one Share per machine, in constant memory (see above).'''
+    def __init__(self, machines, Q=None, chunk_size=CHUNK_SIZE):
+        assert np is not None, 'SecureAggregators require NumPy.'
+        assert len(machines) == len(set(machines))
+        self.machines = list(machines)
+        self.Q = Q
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        '''Start over from a sum of 0 (with no contributions).'''
+        self.count = 0
+        self.shares = [Share(0, machine, self.Q) for machine in self.machines]
+
+    def add(self, values):
+        '''Add an iterable (or array) of contributions to the sum. They're read lazily, chunk_size at a time.'''
+        take = _reader(values, self.Q)
+        chunk = take(self.chunk_size)
+        while chunk is not None:
+            self._add_chunk(chunk)
+            chunk = take(self.chunk_size)
+        return self
+
+    def running(self, values, every):
+        '''Add an iterable of contributions to the sum, and yield (count, sum so far) after every `every` of them
+           (and after the last one). Only these sums are opened.'''
+        take = _reader(values, self.Q)
+        while True:
+            chunk = take(min(self.chunk_size, every - self.count % every))  # (so that chunks end at every multiple of every)
+            if chunk is None: break
+            self._add_chunk(chunk)
+            if self.count % every == 0: yield self.count, self.open()
+        if self.count % every != 0: yield self.count, self.open()
+
+    def windows(self, values, size):
+        '''Yield the sum of each window of `size` consecutive contributions from an iterable (and of the last,
+           partial window). Only these sums are opened. This starts over from a sum of 0, and ends with one.'''
+        self.reset()
+        take = _reader(values, self.Q)
+        while True:
+            chunk = take(min(self.chunk_size, size - self.count))
+            if chunk is None: break
+            self._add_chunk(chunk)
+            if self.count == size: yield self.open(); self.reset()
+        if self.count > 0: yield self.open(); self.reset()
+
+    def shared(self):
+        '''Returns the sum so far as a SharedScalar, without opening it (e.g. to compute on it further).'''
+        from .tinysmpc import SharedScalar
+        return SharedScalar(list(self.shares), self.Q)
+
+    def open(self, strategy=None):
+        '''Open the sum so far to every machine, and return it (see opening.py).'''
+        return self.shared().open(strategy)
+
+    def reconstruct(self, owner, strategy=None):
+        '''Reconstruct the sum so far on one machine, as a PrivateScalar.'''
+        return self.shared().reconstruct(owner, strategy)
+
+    def mean(self):
+        '''Open the mean of the contributions so far (in the int64 ring, or of their representatives in [0, Q)).'''
+        assert self.count > 0, 'Cannot take the mean of no contributions'
+        return self.open() / self.count
+
+    @profiled('aggregate_chunk')
+    def _add_chunk(self, chunk):
+        '''Split each contribution in a chunk into random shares (one per machine), and add them to each machine's total.'''
+        assert_is_array_element(chunk, self.Q)
+        share_values = split_array(to_ring_array(chunk, self.Q), len(self.machines), self.Q)
+        self.shares = [share + _ring_sum(values, self.Q) for share, values in zip(self.shares, share_values)]
+        self.count += len(chunk)
+
+def secure_sum(values, machines, Q=None, chunk_size=CHUNK_SIZE):
+    '''Returns the sum of an iterable of contributions, computed with a SecureAggregator on machines.'''
+    return SecureAggregator(machines, Q, chunk_size).add(values).open()
+
+def _reader(values, Q=None):
+    '''Returns a function take(n), which returns the next (up to) n values as an array, or None at the end.'''
+    if isinstance(values, np.ndarray):
+        flat, position = values.reshape(-1), 0
+        def take(n):
+            nonlocal position
+            chunk = flat[position:position + n]
+            position += len(chunk)
+            return chunk if len(chunk) > 0 else None
+        return take
+
+    iterator = iter(values)
+    def take(n):
+        items = list(islice(iterator, n))
+        if ring_dtype(Q) is object: chunk = np.array(items, dtype=object)
+        else:
+            try: chunk = np.fromiter(items, dtype=np.int64, count=len(items))
+            except OverflowError: assert_is_array_element(np.array(items, dtype=object), Q); raise  # (to report which values don't fit)
+        return chunk if len(chunk) > 0 else None
+    return take
+
+def _ring_sum(values, Q=None):
+    '''Returns the sum of a ring array, as a ring element (a Python int).'''
+    if Q is None: return int(from_ring_array(np.asarray(values.sum(dtype=np.uint64))))  # (uint64 overflows natively)
+    if values.dtype == object or len(values) * (Q - 1) > MAX_INT64: return int(values.astype(object).sum()) % Q
+    return int(values.sum()) % Q
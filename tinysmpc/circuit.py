@@ -0,0 +1,274 @@
+# This module defines an (opt-in) lazy mode for SharedScalars and SharedTensors:
+# instead of running each operation immediately, we build an expression graph,
+# compile it into an arithmetic circuit, and then evaluate the circuit layer by layer.
+#
+# Every operator on a SharedScalar normally runs immediately. So `x**8` runs 7
+# multiplications one after another (7 rounds of communication), and in `a*b + c*d`
+# the two multiplications can't share a round. A compiled circuit instead:
+#   1) folds public constants (e.g. `2 * (3 * x)` is `6 * x`, and `x * 0` is 0)
+#   2) rewrites powers and products into minimum-depth trees (e.g. `x**8` is 3 squarings)
+#   3) eliminates common subexpressions (e.g. `x*y + x*y` only multiplies once)
+#   4) counts the multiplication triples (and square pairs, for squarings) that it needs
+# and then runs all of the multiplications of each layer in a single round.
+#
+# You can compile a function once, and evaluate it on many inputs:
+#
+#   circuit = compile_circuit(lambda x, y: x**8 + x*y)
+#   circuit(shared_x, shared_y)   # 3 rounds, 1 triple, 3 square pairs
+#
+# Or you can make a single computation lazy:
+#
+#   x, y = shared_x.lazy(), shared_y.lazy()
+#   (x**8 + x*y).compute()
+#
+# This implements the standard approach of compiling a circuit and evaluating it level by level,
+# e.g. as in [1], where the number of rounds is the multiplicative depth of the circuit.
+#
+# [1] Section 3 of https://eprint.iacr.org/2011/535.pdf
+
+from .profiler import profiled
+from .shared_multiplication import _shared_square, _shared_tensor_triple, _shared_triple
+from heapq import heapify, heappop, heappush
+from inspect import signature
+
+class LazyValue():
+    '''A node in the expression graph of a lazy computation.
+       It supports arithmetic with other LazyValues or public integers (+, -, *, **).'''
+    def __init__(self, op, args=(), value=None):
+        self.op = op        # 'input', 'const', 'add', 'mul', or 'pow'
+        self.args = args    # The LazyValues this depends on
+        self.value = value  # The SharedScalar/input index for 'input', integer for 'const', exponent for 'pow'
+
+    def compute(self):
+        '''Compile the expression graph of this value, and evaluate it on its (bound) inputs.'''
+        return compute(self)
+
+    def __add__(self, other):
+        '''Called by: self + other.'''
+        return LazyValue('add', (self, _lift(other)))
+
+    def __radd__(self, other):
+        '''Called by: other + self (when other is not a LazyValue).'''
+        return LazyValue('add', (_lift(other), self))
+
+    def __sub__(self, other):
+        '''Called by: self - other.'''
+        return self + -1*_lift(other)
+
+    def __rsub__(self, other):
+        '''Called by: other - self (when other is not a LazyValue).'''
+        return _lift(other) + -1*self
+
+    def __mul__(self, other):
+        '''Called by: self * other.'''
+        return LazyValue('mul', (self, _lift(other)))
+
+    def __rmul__(self, other):
+        '''Called by: other * self (when other is not a LazyValue).'''
+        return LazyValue('mul', (_lift(other), self))
+
+    def __pow__(self, other):
+        '''Called by: self ** other. Only implemented when other is a public integer > 0.'''
+        assert isinstance(other, int) and other > 0
+        return LazyValue('pow', (self,), other)
+
+    def __repr__(self):
+        if self.op == 'input': return 'LazyValue(input)'
+        if self.op == 'const': return f'LazyValue({self.value})'
+        return f'LazyValue({self.op}, {len(self.args)} args)'
+
+class Gate():
+    '''A gate in a compiled circuit. Gates are created once per unique (op, args, value), so they're shared.'''
+    __slots__ = ('op', 'args', 'value', 'depth', 'id')
+
+    def __init__(self, op, args, value, id):
+        self.op = op        # 'input', 'const', 'add', 'scale' (multiply by a public constant), or 'mul'
+        self.args = args
+        self.value = value  # Input index for 'input', integer for 'const' and 'scale'
+        self.id = id        # Gates are numbered in topological order
+        self.depth = max((arg.depth for arg in args), default=0) + (op == 'mul')
+
+    def __repr__(self):
+        args = ', '.join(f'#{arg.id}' for arg in self.args)
+        return f'#{self.id} = {self.op}({args}{", " if args and self.value is not None else ""}{"" if self.value is None else self.value})'
+
+class Circuit():
+    '''An arithmetic circuit compiled from an expression graph (see above). Call it to evaluate it on inputs.'''
+    def __init__(self, outputs, n_inputs):
+        self._gates = {}  # (op, args, value) -> Gate
+        self.n_inputs = n_inputs
+        built = {}
+        self.outputs = [self._build(output, built) for output in outputs]
+
+        # Keep only the gates that the outputs need, grouped into layers by multiplicative depth
+        needed = {}
+        stack = list(self.outputs)
+        while stack:
+            gate = stack.pop()
+            if gate.id not in needed: needed[gate.id] = gate; stack.extend(gate.args)
+        self.gates = [needed[id] for id in sorted(needed)]
+        self.depth = max((gate.depth for gate in self.gates), default=0)
+        self.layers = [[gate for gate in self.gates if gate.depth == d] for d in range(self.depth + 1)]
+        self.n_squares = sum(gate.op == 'mul' and gate.args[0] is gate.args[1] for gate in self.gates)
+        self.n_triples = sum(gate.op == 'mul' for gate in self.gates) - self.n_squares  # (per element, for SharedTensors)
+
+    @profiled('circuit')
+    def __call__(self, *inputs, rescale=None):
+        '''Evaluate the circuit on SharedScalars (or SharedTensors). Uses one round of communication per layer.
+           rescale is an optional function that's applied to the list of products of each layer (e.g. a truncation, for
+           fixed point, see SharedFixed.polyval). It's only applied to multiplications, not to constants or scale gates.'''
+        from .scheduler import _open_all
+        assert len(inputs) == self.n_inputs, f'This circuit takes {self.n_inputs} inputs, not {len(inputs)}.'
+        values = {}
+        for layer in self.layers:
+            # All of the multiplications in the layer open their masked values in a single round
+            # (Squares use a square pair, and open one value instead of two, like square_sh)
+            mul_gates = [gate for gate in layer if gate.op == 'mul']
+            masks, masked = [], []
+            for gate in mul_gates:
+                sh1, sh2 = values[gate.args[0].id], values[gate.args[1].id]
+                masks.append(_shared_square(sh1) if sh1 is sh2 else _triple_for(sh1, sh2))
+                masked.extend([sh1 - masks[-1][0]] if sh1 is sh2 else [sh1 - masks[-1][0], sh2 - masks[-1][1]])
+            opened = iter(_open_all(masked))
+            for gate, mask in zip(mul_gates, masks):
+                if len(mask) == 2:
+                    (shared_a, shared_a2), sh_m_a = mask, next(opened)
+                    values[gate.id] = shared_a2 + (2 * sh_m_a * shared_a) + (sh_m_a * sh_m_a)
+                else:
+                    (shared_a, shared_b, shared_c), sh1_m_a, sh2_m_b = mask, next(opened), next(opened)
+                    values[gate.id] = shared_c + (sh1_m_a * shared_b) + (sh2_m_b * shared_a) + (sh1_m_a * sh2_m_b)
+            if rescale is not None and mul_gates:
+                for gate, value in zip(mul_gates, rescale([values[gate.id] for gate in mul_gates])): values[gate.id] = value
+
+            # Everything else in the layer is local
+            for gate in layer:
+                if gate.op == 'input':   values[gate.id] = inputs[gate.value]
+                elif gate.op == 'const': values[gate.id] = gate.value
+                elif gate.op == 'add':   values[gate.id] = values[gate.args[0].id] + values[gate.args[1].id]
+                elif gate.op == 'scale': values[gate.id] = gate.value * values[gate.args[0].id]
+        outputs = [values[gate.id] for gate in self.outputs]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def __repr__(self):
+        return f'Circuit({len(self.gates)} gates, depth={self.depth}, triples={self.n_triples}, squares={self.n_squares})\n - ' + '\n - '.join(map(str, self.gates))
+
+    def _gate(self, op, args=(), value=None):
+        '''Returns the unique Gate for (op, args, value), creating it if needed (this is the CSE).'''
+        if op in ('add', 'mul'): args = tuple(sorted(args, key=lambda gate: gate.id))  # (they're commutative)
+        key = (op, tuple(arg.id for arg in args), value)
+        if key not in self._gates: self._gates[key] = Gate(op, args, value, len(self._gates))
+        return self._gates[key]
+
+    def _build(self, root, built):
+        '''Compile a LazyValue into a Gate, folding constants and rewriting products.
+           The graph is walked in post-order with an explicit stack, so deep graphs (e.g. long sums) don't hit the recursion limit.'''
+        stack = [(root, False)]
+        while stack:
+            node, children_built = stack.pop()
+            if id(node) in built: continue
+            if not children_built:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(self._children(node)) if id(child) not in built)
+            else:
+                built[id(node)] = self._build_node(node, built)
+        return built[id(root)]
+
+    def _children(self, node):
+        '''The LazyValues that must be compiled before node (for a product, the factors of the whole flattened product).'''
+        if node.op == 'add': return list(node.args)
+        if node.op in ('mul', 'pow'): return [factor for factor, _ in self._factors(node)]
+        return []
+
+    def _build_node(self, node, built):
+        '''Compile one LazyValue into a Gate, once the LazyValues it depends on are compiled.'''
+        if node.op == 'input': return self._gate('input', value=node.value)
+        if node.op == 'const': return self._gate('const', value=node.value)
+        if node.op == 'add':
+            a, b = (built[id(arg)] for arg in node.args)
+            if a.op == 'const' and b.op == 'const': return self._gate('const', value=a.value + b.value)
+            elif a.op == 'const' and a.value == 0:  return b
+            elif b.op == 'const' and b.value == 0:  return a
+            else:                                   return self._gate('add', (a, b))
+
+        # Flatten the whole product (of muls and pows) into: constant * prod(factor ** exponent)
+        factors, constant = {}, 1
+        for factor, exponent in self._factors(node):
+            gate = built[id(factor)]
+            if gate.op == 'const':   constant *= gate.value ** exponent
+            elif gate.op == 'scale': constant *= gate.value ** exponent; factors[gate.args[0]] = factors.get(gate.args[0], 0) + exponent
+            else:                    factors[gate] = factors.get(gate, 0) + exponent
+        return self._product(factors, constant)
+
+    def _factors(self, node):
+        '''Flatten a product node (of muls and pows) into a list of (factor, exponent) pairs, where no factor is a product.'''
+        factors, stack = [], [(node, 1)]
+        while stack:
+            node, exponent = stack.pop()
+            if node.op == 'mul':   stack.extend((arg, exponent) for arg in reversed(node.args))
+            elif node.op == 'pow': stack.append((node.args[0], exponent * node.value))
+            else:                  factors.append((node, exponent))
+        return factors
+
+    def _product(self, factors, constant):
+        '''Returns a Gate for constant * prod(factor ** exponent), with the minimum multiplicative depth.'''
+        if constant == 0 or not factors: return self._gate('const', value=constant)
+
+        # Each factor ** exponent is a product of repeated squares: factor ** (2**k), for each bit k of the exponent
+        leaves = []
+        for factor, exponent in factors.items():
+            square = factor
+            while exponent:
+                if exponent & 1: leaves.append(square)
+                exponent >>= 1
+                if exponent: square = self._gate('mul', (square, square))
+
+        # Then, multiply the two shallowest gates until there's one left (like Huffman coding, but with depth)
+        heap = [(leaf.depth, leaf.id, leaf) for leaf in leaves]
+        heapify(heap)
+        while len(heap) > 1:
+            _, _, a = heappop(heap)
+            _, _, b = heappop(heap)
+            prod = self._gate('mul', (a, b))
+            heappush(heap, (prod.depth, prod.id, prod))
+        gate = heap[0][2]
+        return gate if constant == 1 else self._gate('scale', (gate,), constant)
+
+def compile_circuit(fn):
+    '''Compile a function of SharedScalars (using +, -, *, ** with public integers) into a reusable Circuit.'''
+    n_inputs = len(signature(fn).parameters)
+    outputs = fn(*[LazyValue('input', value=i) for i in range(n_inputs)])
+    outputs = list(outputs) if isinstance(outputs, (list, tuple)) else [outputs]
+    return Circuit([_lift(output) for output in outputs], n_inputs)
+
+def compute(*outputs):
+    '''Compile and evaluate lazy values (whose inputs are SharedScalars or SharedTensors, see SharedScalar.lazy()).'''
+    # Find the bound inputs, and make a copy of the graph where they're numbered
+    inputs, copies = [], {}
+    def number_inputs(root):
+        # (in post-order, with an explicit stack, like Circuit._build)
+        stack = [(root, False)]
+        while stack:
+            node, children_copied = stack.pop()
+            if id(node) in copies: continue
+            if node.op == 'input':
+                copies[id(node)] = LazyValue('input', value=len(inputs))
+                inputs.append(node.value)
+            elif not children_copied:
+                stack.append((node, True))
+                stack.extend((arg, False) for arg in reversed(node.args) if id(arg) not in copies)
+            else:
+                copies[id(node)] = LazyValue(node.op, tuple(copies[id(arg)] for arg in node.args), node.value)
+        return copies[id(root)]
+    circuit = Circuit([number_inputs(_lift(output)) for output in outputs], len(inputs))
+    return circuit(*inputs)
+
+def _lift(value):
+    '''Turns a public integer into a constant LazyValue.'''
+    if isinstance(value, LazyValue): return value
+    assert isinstance(value, int), f'{value} is not a LazyValue or a public integer.'
+    return LazyValue('const', value=value)
+
+def _triple_for(sh1, sh2):
+    '''Returns a shared multiplication triple for sh1 * sh2 (SharedScalars or SharedTensors).'''
+    sh1._assert_can_operate(sh2)
+    return _shared_tensor_triple(sh1, sh2) if hasattr(sh1, 'shape') else _shared_triple(sh1)
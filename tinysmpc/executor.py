@@ -0,0 +1,154 @@
+# This module defines a PartyExecutor, which runs the machines' local computations in parallel.
+#
+# Between rounds of communication, each machine computes on its own shares, independently
+# of the others (e.g. in add_2sh, each machine adds its two shares). TinySMPC simulates all
+# of the machines in one Python process, so it normally does this one machine after another,
+# on one core. While a PartyExecutor is active, these per-machine steps run on a pool of
+# workers instead:
+#   - the arithmetic on each machine's TensorShares (add_2sh, mult_sh_pub, matmul_sh_pub, etc.)
+#   - expanding each machine's PRG seed into its share (see secret_sharing.py)
+#   - each machine's (n, L) arrays in the batched PrivateCompare (see shared_comparison.py)
+#
+#   with PartyExecutor(workers=4):
+#       shared_prod = shared_x * shared_y  # For large SharedTensors
+#
+# It can also run independent operations (e.g. on different batches) concurrently, with map():
+#
+#   with PartyExecutor(workers=4, seed=0) as executor:
+#       prods = executor.map(lambda x: (x * x).open(), shared_batches)
+#
+# Threads (the default) work well, because NumPy releases the GIL during array operations.
+# With kind='process', the pure array kernels (seed expansion and PrivateCompare) run in
+# worker processes instead, which also avoids the GIL, but copies their inputs and outputs
+# between processes. (Shares can't be sent to another process, since they refer to their
+# machines, so everything else still runs on threads.)
+#
+# Per-machine steps on small shares (e.g. Shares of a single integer) still run serially,
+# since handing them to a worker would cost more than the work itself.
+#
+# Determinism: the per-machine steps don't draw any random values, so their results are the
+# same as when running serially. With a seed, the thread that activates the executor draws its
+# random values from a generator seeded by it (see local_rng in finite_ring.py), including the
+# triples of TriplePools that it creates while the executor is active, and each task of map()
+# gets its own generator, derived from the seed and the task's index. So the same seed gives the
+# same shares and results, with any number of workers, however the tasks are scheduled.
+# The seed only applies to the executor's own work: other threads keep drawing from the process's
+# generator (fresh, or seeded with seed_random), which continues where it was after the executor.
+
+from .finite_ring import local_rng, np
+from .profiler import running_operations, running_as
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from os import cpu_count
+from threading import local
+
+KINDS = ('thread', 'process')
+MIN_SIZE = 2**14  # Shares with fewer elements than this are computed on serially (see above)
+
+_active_executor = None  # The PartyExecutor used by the protocols
+_worker = local()        # (worker threads set _worker.busy, so that they don't wait on the pool they're part of)
+
+class PartyExecutor():
+    '''A pool of workers that computes each machine's local steps (and independent operations) in parallel.'''
+    def __init__(self, workers=None, kind='thread', seed=None, min_size=MIN_SIZE):
+        assert kind in KINDS, f'{kind} is not a kind of PartyExecutor. Use one of {KINDS}.'
+        self.workers = workers or cpu_count() or 1
+        self.kind = kind
+        self.seed = seed
+        self.min_size = min_size
+        self._threads = ThreadPoolExecutor(self.workers, thread_name_prefix='tinysmpc-party')
+        self._processes = ProcessPoolExecutor(self.workers, initializer=_init_process) if kind == 'process' else None
+        self._seeding = ExitStack()  # (the seeded generator of the activating thread, while active)
+
+    def map(self, fn, *iterables):
+        '''Call fn on each item of the iterables (like the builtin map), concurrently. Returns a list of the results, in order.
+           With a seed, each call draws its random values from its own generator, so the results are reproducible.'''
+        args = list(zip(*iterables))
+        if getattr(_worker, 'busy', False): return [fn(*task_args) for task_args in args]  # (called from inside a task)
+        if self.seed is None: rngs = [None] * len(args)
+        else: rngs = [np.random.default_rng([self.seed, i]) for i in range(len(args))]
+        stacks = running_operations()
+        futures = [self._threads.submit(_run_task, fn, task_args, rng, stacks) for task_args, rng in zip(args, rngs)]
+        return [future.result() for future in futures]
+
+    def activate(self):
+        '''Make the protocols run each machine's local steps on this executor (and seed this thread's randomness, if there's a seed).'''
+        global _active_executor
+        _active_executor = self
+        if self.seed is not None: self._seeding.enter_context(local_rng(np.random.default_rng(self.seed)))
+        return self
+
+    def deactivate(self):
+        '''Make the protocols go back to running serially (and this thread to the randomness it had before, if there's a seed).
+           Call it from the thread that activated the executor.'''
+        global _active_executor
+        if _active_executor is not self: return
+        _active_executor = None
+        self._seeding.close()
+
+    def shutdown(self):
+        '''Deactivate this executor, and stop its workers.'''
+        self.deactivate()
+        self._threads.shutdown()
+        if self._processes is not None: self._processes.shutdown()
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def __repr__(self):
+        return f'PartyExecutor(workers={self.workers}, kind=\'{self.kind}\', seed={self.seed})'
+
+def active_executor():
+    '''Returns the active PartyExecutor, or None.'''
+    return _active_executor
+
+def party_map(fn, *iterables, size=None):
+    '''Compute fn on each machine's items (e.g. fn(share1, share2) for each machine's two shares), on the active
+       PartyExecutor's threads, or serially (see above). Returns a list of the results, in order.
+       size is the number of elements each call works on (by default, that of its largest share or array).'''
+    args = list(zip(*iterables))
+    executor = _parallel_executor(args, size)
+    if executor is None: return [fn(*task_args) for task_args in args]
+    stacks = running_operations()
+    futures = [executor._threads.submit(_run_task, fn, task_args, None, stacks) for task_args in args]
+    return [future.result() for future in futures]
+
+def kernel_map(fn, *iterables, size=None):
+    '''Like party_map, but for a pure function of arrays and integers (defined at the top level of a module),
+       which runs on the active PartyExecutor's processes if it has any (and otherwise, like party_map).'''
+    args = list(zip(*iterables))
+    executor = _parallel_executor(args, size)
+    if executor is None or executor._processes is None: return party_map(fn, *zip(*args), size=size)
+    futures = [executor._processes.submit(fn, *task_args) for task_args in args]
+    return [future.result() for future in futures]
+
+def _parallel_executor(args, size=None):
+    '''Returns the executor to run these tasks on, or None if they should run serially.'''
+    executor = _active_executor
+    if executor is None or executor.workers <= 1 or len(args) <= 1 or getattr(_worker, 'busy', False): return None
+    return executor if (_size(args[0]) if size is None else size) >= executor.min_size else None
+
+def _size(task_args):
+    '''The number of elements in the largest share (or array) in a task's arguments.'''
+    sizes = [getattr(getattr(arg, 'value', arg), 'size', 0) for arg in task_args if not getattr(arg, 'is_remote', False)]
+    sizes = [size for size in sizes if isinstance(size, int)]
+    return max(sizes, default=0)
+
+def _run_task(fn, args, rng, stacks):
+    '''Run one task on a worker thread (with its own generator, if it has one), attributing its
+       counts to the operation that started it (see profiler.py).'''
+    _worker.busy = True
+    try:
+        with running_as(stacks):
+            if rng is None: return fn(*args)
+            with local_rng(rng): return fn(*args)
+    finally:
+        _worker.busy = False
+
+def _init_process():
+    '''A worker process doesn't have an active PartyExecutor (it can't use its parent's pools).'''
+    global _active_executor
+    _active_executor = None
@@ -22,7 +22,13 @@
 # [2] https://math.stackexchange.com/q/3692052/28855
 # [3] https://mortendahl.github.io/2017/09/03/the-spdz-protocol-part1/
 
+from contextlib import contextmanager
+from os import register_at_fork, urandom
 from random import randint, randrange
+from threading import Lock, local
+
+try: import numpy as np
+except ImportError: np = None  # NumPy is only needed for PrivateTensors and SharedTensors
 
 # Anywhere in the codebase, if Q is None, that means we're computing with int64s!
 # This is the default behavior. (See the mathematical note above for why.)
@@ -44,6 +50,10 @@ def rand_element(Q=None):
     if Q is not None: return randrange(Q)
     return randint(MIN_INT64, MAX_INT64)
 
+def element_size(Q=None):
+    '''Returns the number of bytes needed to store one element of the int64 ring, or the size-Q prime ring.'''
+    return 8 if Q is None else (Q.bit_length() + 7) // 8
+
 def assert_is_element(n, Q=None):
     '''Assert that n is a valid int64, or a valid integer mod Q, if Q is provided.'''
     val = n if isinstance(n, int) else n.value
@@ -51,3 +61,139 @@ def assert_is_element(n, Q=None):
         assert MIN_INT64 <= val <= MAX_INT64, f'{n} is not an int64 and cannot be reconstructed. Use a smaller value.'
     else:
         assert 0 <= val < Q, f'{n} does not fit inside a size-{Q} prime ring, so it cannot be split into shares that can be reconstructed. Use a larger Q or a smaller value.'
+
+# Array versions of the functions above, used by PrivateTensor and SharedTensor.
+#
+# A ring array stores a whole batch of ring elements in one contiguous NumPy array:
+#   - In the int64 ring, it's a uint64 array, so + and * get native 2^64 wraparound 
+#     for free. (This is the same bit pattern as the int64 value; see from_ring_array.)
+#   - In a prime ring, it's an int64 array holding values in [0, Q), as long as the 
+#     product of two elements still fits in an int64. Otherwise we fall back to an 
+#     object array of Python ints, which is slower but still vectorized.
+
+def ring_dtype(Q=None):
+    '''Returns the NumPy dtype used to store elements of the int64 ring or the size-Q prime ring.'''
+    if Q is None: return np.uint64
+    if (Q - 1)**2 <= MAX_INT64: return np.int64
+    return object
+
+def to_ring_array(values, Q=None):
+    '''Converts an integer or array-like of integers into a ring array (see above).'''
+    assert np is not None, 'PrivateTensors and SharedTensors require NumPy.'
+    arr = np.asarray(values)
+    if arr.dtype == ring_dtype(Q): return arr if Q is None else np.asarray(arr % Q, dtype=arr.dtype)
+    if Q is None:
+        if arr.dtype.kind == 'O': arr = np.vectorize(mod, otypes=[object])(arr)
+        return arr.astype(np.int64).view(np.uint64)
+    return np.asarray(arr.astype(object) % Q).astype(ring_dtype(Q))
+
+def from_ring_array(arr, Q=None):
+    '''Converts a ring array back into normal integers (int64s, or integers [0, Q)).'''
+    if Q is None: return arr.view(np.int64)
+    return arr
+
+def mod_array(arr, Q=None):
+    '''Keeps a ring array inside the finite ring (the array version of mod).
+       The int64 ring overflows natively, so this is only needed for prime rings.'''
+    if Q is not None: return arr % Q
+    return arr
+
+def matmul_array(a, b, Q=None):
+    '''Matrix product of two ring arrays (with the same rules as NumPy's a @ b), kept inside the finite ring.'''
+    if Q is None: return np.asarray(a @ b)  # (uint64 overflows natively)
+    if a.dtype == object or b.dtype == object: return np.asarray((a.astype(object) @ b.astype(object)) % Q, dtype=object)
+
+    # In an int64 prime ring, each product fits in an int64, but a long sum of them might not.
+    # So we sum as many products at a time as we can, and reduce mod Q in between.
+    step = (MAX_INT64 - Q) // (Q - 1)**2 if Q > 1 else a.shape[-1]
+    if step < 1: return np.asarray((a.astype(object) @ b.astype(object)) % Q).astype(np.int64)
+    k = a.shape[-1]
+    res = (a[..., :step] @ b[:step] if b.ndim == 1 else a[..., :step] @ b[..., :step, :]) % Q
+    for i in range(step, k, step):
+        res = (res + (a[..., i:i+step] @ b[i:i+step] if b.ndim == 1 else a[..., i:i+step] @ b[..., i:i+step, :])) % Q
+    return np.asarray(res)
+
+def rand_array(shape, Q=None, rng=None):
+    '''Generates an array of random elements of the int64 ring, or the size-Q prime ring.
+       rng is an optional NumPy Generator (e.g. so that each thread can use its own).'''
+    assert np is not None, 'PrivateTensors and SharedTensors require NumPy.'
+    rng = _current_rng() if rng is None else rng
+    if Q is None: return rng.integers(0, 2**64, size=shape, dtype=np.uint64)
+    if ring_dtype(Q) is np.int64: return rng.integers(0, Q, size=shape, dtype=np.int64)
+
+    # For a large Q, combine enough random 64-bit limbs for 64 extra bits, and reduce mod Q
+    # (which is uniform, up to a statistical distance of at most 2^-64)
+    n_limbs = (Q.bit_length() + 64 + 63) // 64
+    shape = (shape,) if isinstance(shape, int) else tuple(shape)
+    limbs = rng.integers(0, 2**64, size=(n_limbs, *shape), dtype=np.uint64).astype(object)
+    return np.asarray(sum(limb << (64 * i) for i, limb in enumerate(limbs)) % Q, dtype=object)
+
+def rand_elements(n, Q=None):
+    '''Generates a list of n random elements of the int64 ring, or the size-Q prime ring (as Python ints).
+       With NumPy, they're drawn in bulk (thousands at a time) and buffered, so each call is cheap.'''
+    if np is None: return [rand_element(Q) for _ in range(n)]
+    if getattr(_local, 'rng', None) is not None: return from_ring_array(rand_array(n, Q), Q).tolist()  # (see local_rng)
+    with _buffer_lock:
+        buffer = _buffers.setdefault(Q, [])
+        if len(buffer) < n: buffer.extend(from_ring_array(rand_array(max(n, _BUFFER_SIZE), Q), Q).tolist())
+        values = buffer[len(buffer)-n:]
+        del buffer[len(buffer)-n:]
+    return values
+
+def assert_is_array_element(values, Q=None):
+    '''Assert that every value in an array-like is a valid int64, or a valid integer mod Q.'''
+    arr = np.asarray(values)
+    assert arr.dtype.kind in 'iuO', f'{arr} is not an array of integers.'
+    if arr.size == 0 or (Q is None and arr.dtype == np.uint64): return  # (Already a ring array)
+    lo, hi = (MIN_INT64, MAX_INT64) if Q is None else (0, Q-1)
+    assert lo <= int(arr.min()) and int(arr.max()) <= hi, \
+        f'{arr} does not fit inside the {"int64" if Q is None else f"size-{Q} prime"} ring, so it cannot be split into shares that can be reconstructed.'
+
+def rand_bytes(n):
+    '''Generates n random bytes (e.g. for a PRG seed), from the OS, or from the seeded generator (see seed_random),
+       or from this thread's generator (see local_rng).'''
+    return _current_rng().bytes(n) if _seeded or getattr(_local, 'rng', None) is not None else urandom(n)
+
+def seed_random(seed=None):
+    '''Draw all of TinySMPC's random values from a generator seeded with seed, so that computations are reproducible
+       (e.g. in tests and benchmarks). This is *not* secure: anyone who knows the seed can compute every share!
+       seed_random(None) goes back to fresh randomness (and PRG seeds from the OS).'''
+    global _rng, _seeded
+    with _buffer_lock:
+        _rng = np.random.default_rng(seed) if np is not None else None
+        _buffers.clear()
+        _seeded = seed is not None
+
+def new_rng():
+    '''Returns a new, independent NumPy Generator (e.g. for a background thread). If the randomness is seeded
+       (see seed_random), or this thread has its own generator (see local_rng), it's seeded from it, so it's reproducible too.'''
+    if not _seeded and getattr(_local, 'rng', None) is None: return np.random.default_rng()
+    return np.random.default_rng(int(_current_rng().integers(0, 2**63)))
+
+@contextmanager
+def local_rng(rng):
+    '''Draw this thread's random values from the NumPy Generator rng, instead of the shared one
+       (e.g. so that each task of a PartyExecutor draws the same values, however the tasks are scheduled).'''
+    previous = getattr(_local, 'rng', None)
+    _local.rng = rng
+    try: yield rng
+    finally: _local.rng = previous
+
+def _current_rng():
+    return getattr(_local, 'rng', None) or _rng
+
+_rng = np.random.default_rng() if np is not None else None
+_seeded = False  # Whether _rng was seeded (see seed_random)
+_local = local()  # Per-thread generators (see local_rng)
+_buffers = {}  # Q -> list of random elements, for rand_elements
+_buffer_lock = Lock()
+_BUFFER_SIZE = 4096
+
+def _reseed_after_fork():
+    '''A forked process (e.g. a ProcessMachine's worker) must not reuse its parent's random values.'''
+    global _rng, _buffer_lock
+    _rng = np.random.default_rng() if np is not None else None
+    _buffers.clear()
+    _buffer_lock = Lock()
+
+register_at_fork(after_in_child=_reseed_after_fork)
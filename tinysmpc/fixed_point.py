@@ -17,4 +17,32 @@ def float_point(n, n_mults=0):
        n_mults is the number of multiplications that generated the int, since multiplications
        of fixed point integers will accumulate extra scaling factors.'''
     scale_factor = (10**PRECISION)**n_mults
-    return n / 10**PRECISION / scale_factor
\ No newline at end of file
+    return n / 10**PRECISION / scale_factor
+
+def fixed_point_coeffs(coeffs):
+    '''Converts the float coefficients of a polynomial (highest degree first, like numpy.polyval) to fixed point ints,
+       for evaluating it on a fixed point x. The term coeffs[i] * x**(degree-i) has (degree-i + 1) scaling factors,
+       so each coefficient is scaled up to the same (degree + 1) factors: use float_point(result, n_mults=degree).'''
+    return [fixed_point(coeff) * (10**PRECISION)**i for i, coeff in enumerate(coeffs)]
+
+# Binary fixed point, used by SharedFixed (see tinysmpc.py and shared_truncation.py).
+#
+# A float is stored as an int with FRAC_BITS fractional bits, i.e. scaled by 2**FRAC_BITS.
+# Since the scale is a power of two, rescaling after a multiplication is just a bit shift.
+
+FRAC_BITS = 16
+
+def to_fixed(fl, frac_bits=FRAC_BITS):
+    '''Converts a float (or array of floats) to a binary fixed point int (or int64 array), with frac_bits fractional bits.'''
+    if isinstance(fl, (int, float)):
+        n = round(fl * 2**frac_bits)
+        assert MIN_INT64 <= n <= MAX_INT64, f'{fl} is too large for {frac_bits} fractional bits in an int64.'
+        return n
+    import numpy as np
+    scaled = np.round(np.asarray(fl, dtype=float) * 2**frac_bits)
+    assert scaled.size == 0 or (MIN_INT64 <= scaled.min() and scaled.max() < MAX_INT64), f'{fl} is too large for {frac_bits} fractional bits in an int64.'
+    return scaled.astype(np.int64)
+
+def from_fixed(n, frac_bits=FRAC_BITS):
+    '''Converts a binary fixed point int (or array of ints) with frac_bits fractional bits back to a float (or array of floats).'''
+    return n / 2**frac_bits
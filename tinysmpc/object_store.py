@@ -0,0 +1,128 @@
+# This module defines how a VirtualMachine keeps track of the objects it owns
+# (PrivateScalars, PrivateTensors, Shares, and TensorShares).
+#
+# Every protocol creates lots of intermediate objects: e.g. each mult_2sh creates
+# a triple, masked values, and reconstructed copies. If a machine held a normal
+# list of all of its objects, none of these could ever be freed, and a long-running
+# process would grow without bound.
+#
+# Instead, an ObjectStore only holds weak references [1], stored in two flat columns
+# (one entry per object: its weak reference, and its approximate size). So an object
+# lives exactly as long as the user's code (e.g. a SharedScalar) still refers to it,
+# and `repr(machine)` shows the objects that are alive right now.
+#
+# If you do want to keep intermediates around (e.g. to inspect them), create them
+# inside a scope, which holds them until it's released, all at once:
+#
+#   with alice.scope() as scope:
+#       shared_prod = shared_a * shared_b
+#   print(scope.objects)  # All of alice's intermediates from the multiplication
+#   scope.release()       # Now they can be freed
+#
+# Objects can be created on several threads at once (e.g. by a PartyExecutor, see executor.py),
+# so the columns are guarded by a lock, and each thread has its own stack of open scopes.
+#
+# [1] https://docs.python.org/3/library/weakref.html
+
+from array import array
+from sys import getsizeof
+from threading import RLock, local
+from weakref import ref
+
+class ObjectStore():
+    '''The objects owned by a VirtualMachine. Tracks them without keeping them alive (see above).'''
+    __slots__ = ('_refs', '_sizes', '_n_dead', '_lock', '_local')
+
+    def __init__(self):
+        self._refs = []                # Column of weak references to each object
+        self._sizes = array('Q')       # Column of each object's approximate size in bytes
+        self._n_dead = 0               # Number of entries whose object has been freed
+        self._lock = RLock()           # Guards the columns (reentrant, since a freed object's callback can run anywhere)
+        self._local = local()          # Each thread's stack of currently open scopes (see _scopes)
+
+    def append(self, obj):
+        '''Start tracking an object that belongs to this machine.'''
+        size = _sizeof(obj)
+        with self._lock:
+            if self._n_dead > 64 and self._n_dead > len(self._refs) // 2: self._compact()
+            self._refs.append(ref(obj, self._on_collect))
+            self._sizes.append(size)
+        scopes = self._scopes
+        if scopes: scopes[-1]._objects.append(obj)
+
+    def scope(self):
+        '''Returns a new Scope. Objects created inside `with scope:` are kept alive until scope.release().'''
+        return Scope(self)
+
+    def footprint(self):
+        '''Returns the approximate memory used by the live objects and by the store itself, in bytes.'''
+        with self._lock: refs, sizes = list(self._refs), array('Q', self._sizes)
+        live_bytes = sum(size for r, size in zip(refs, sizes) if r() is not None)
+        store_bytes = getsizeof(refs) + sum(map(getsizeof, refs)) + getsizeof(sizes)
+        return live_bytes + store_bytes
+
+    def __iter__(self):
+        with self._lock: refs = list(self._refs)
+        for r in refs:
+            obj = r()
+            if obj is not None: yield obj
+
+    def __len__(self):
+        with self._lock: return len(self._refs) - self._n_dead
+
+    def __repr__(self):
+        return f'ObjectStore({len(self)} objects, {self.footprint()} bytes)'
+
+    def _on_collect(self, _):
+        '''Called whenever a tracked object is freed.'''
+        with self._lock: self._n_dead += 1
+
+    @property
+    def _scopes(self):
+        '''This thread's stack of currently open scopes.'''
+        scopes = getattr(self._local, 'scopes', None)
+        if scopes is None: scopes = self._local.scopes = []
+        return scopes
+
+    def _compact(self):
+        '''Drop the columns' entries for objects that have been freed (called with the lock held).'''
+        alive = [i for i, r in enumerate(self._refs) if r() is not None]
+        self._refs = [self._refs[i] for i in alive]
+        self._sizes = array('Q', (self._sizes[i] for i in alive))
+        self._n_dead = 0
+
+class Scope():
+    '''An arena of objects created on one machine, which are kept alive until they're released in bulk.'''
+    __slots__ = ('store', '_objects')
+
+    def __init__(self, store):
+        self.store = store
+        self._objects = []
+
+    @property
+    def objects(self):
+        return list(self._objects)
+
+    def footprint(self):
+        '''Returns the approximate memory used by the objects in this scope, in bytes.'''
+        return sum(map(_sizeof, self._objects))
+
+    def release(self):
+        '''Stop keeping this scope's objects alive (they're freed if nothing else refers to them).'''
+        self._objects = []
+
+    def __enter__(self):
+        self.store._scopes.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.store._scopes.remove(self)
+
+    def __repr__(self):
+        return f'Scope({len(self._objects)} objects, {self.footprint()} bytes)'
+
+def _sizeof(obj):
+    '''Returns the approximate size of an object and its value, in bytes.'''
+    if getattr(obj, 'is_remote', False): return getsizeof(obj)  # (its value is stored in another process)
+    value = obj.value
+    return getsizeof(obj) + (value.nbytes if hasattr(value, 'nbytes') else getsizeof(value))
@@ -0,0 +1,128 @@
+# This module defines how the machines send each other their shares, to open a
+# shared value to every machine (e.g. sh1 - a in a multiplication, which all of the
+# machines need), or to reconstruct it on one machine.
+#
+# With a few machines, the simplest way is the best. With many, it matters who sends
+# what to whom, so we support a few strategies:
+#
+#   - 'all_to_all': every machine sends its share to every other machine, in 1 round.
+#      That's n*(n-1) messages, so it's only good for a few machines.
+#   - 'king': every machine sends its share to one machine (the king), which adds them
+#      up and sends the sum back to everyone, in 2 rounds and 2*(n-1) messages.
+#      The king rotates from one opening to the next, so no machine does all of the work.
+#   - 'tree': the machines add up their shares along a binomial tree, and send the sum
+#      back down the tree, in 2*ceil(log2(n)) rounds and 2*(n-1) messages. No machine
+#      sends or receives more than ceil(log2(n)) messages.
+#   - 'reduce_scatter': (for SharedTensors) each machine adds up one 1/n slice of the
+#      array (reduce-scatter), and then sends its slice of the sum to everyone (all-gather),
+#      in 2 rounds [1]. Each machine sends about 2 arrays' worth of bytes, however many
+#      machines there are, instead of the king sending and receiving n arrays.
+#
+# To reconstruct a value on one machine only, the sum is only sent to that machine
+# (which is also the king, or the root of the tree).
+#
+# By default, the strategy is chosen by the number of machines (see choose_strategy),
+# but it can also be chosen per call, e.g. shared.open('tree') or shared.reconstruct(alice, 'king').
+#
+# [1] https://en.wikipedia.org/wiki/Collective_operation#Reduce-Scatter
+
+from .finite_ring import from_ring_array, np
+from .profiler import count_round, profiled
+from itertools import count
+
+STRATEGIES = ('all_to_all', 'king', 'tree', 'reduce_scatter')
+MAX_ALL_TO_ALL = 3  # Up to this many machines, open all-to-all (1 round, and few messages)
+MAX_KING = 16       # Up to this many machines, open SharedScalars with a king (and with a tree, after that)
+
+_openings = count()  # Counts openings, to rotate the king (or root of the tree)
+
+def choose_strategy(n_machines, size=1):
+    '''Returns the default opening strategy for n_machines, and a value with size elements.'''
+    if n_machines <= MAX_ALL_TO_ALL: return 'all_to_all'
+    if size >= n_machines:           return 'reduce_scatter'
+    return 'king' if n_machines <= MAX_KING else 'tree'
+
+@profiled('open_shares')
+def open_shares(shares, Q=None, strategy=None):
+    '''Open the value hidden by a list of Shares (or TensorShares) to every machine, and return it.'''
+    return _open(shares, Q, strategy, None)
+
+def reconstruct_shares(shares, owner, Q=None, strategy=None):
+    '''Reconstruct the value hidden by a list of Shares (or TensorShares) on one machine (owner), and return it.'''
+    return _open(shares, Q, strategy, owner)
+
+def _open(shares, Q, strategy, to):
+    '''Run an opening strategy, where to is the machine that learns the value (or None, for every machine).'''
+    is_tensor = hasattr(shares[0], 'shape')
+    strategy = strategy or choose_strategy(len(shares), shares[0].value.size if is_tensor else 1)
+    assert strategy in STRATEGIES, f'{strategy} is not an opening strategy. Use one of {STRATEGIES}.'
+    if strategy == 'reduce_scatter' and not is_tensor: strategy = 'tree'  # (a single value can't be split up)
+    total = _STRATEGIES[strategy](shares, to)
+    return from_ring_array(total.value, Q) if is_tensor else total.value
+
+def _all_to_all(shares, to):
+    '''Every machine sends its share to every other machine (or only to `to`), in 1 round.'''
+    count_round()
+    receivers = [to] if to is not None else [share.owner for share in shares]
+    sums = [sum(share.send_to(receiver) for share in shares) for receiver in receivers]
+    return sums[0]
+
+def _king(shares, to):
+    '''Every machine sends its share to the king, which sends the sum to every other machine (2 rounds).'''
+    machines = [share.owner for share in shares]
+    king = to if to is not None else machines[next(_openings) % len(machines)]
+    count_round()
+    total = sum(share.send_to(king) for share in shares)
+    if to is None:
+        count_round()
+        for machine in machines:
+            if machine is not king: total.send_to(machine)
+    return total
+
+def _tree(shares, to):
+    '''The machines add up their shares along a binomial tree rooted at `to` (or a rotating root),
+       and then send the sum back down the tree (2*ceil(log2(n)) rounds).'''
+    share_of = {share.owner: share for share in shares}
+    machines = list(share_of)
+    root = to if to is not None else machines[next(_openings) % len(machines)]
+    order = [root] + [machine for machine in machines if machine is not root]
+    acc = [share_of.get(machine) for machine in order]  # (the root has no share, if it's not one of the machines)
+
+    # Reduce: in each round, machine i + step sends its partial sum to machine i
+    steps, step = [], 1
+    while step < len(order):
+        count_round()
+        for i in range(0, len(order) - step, 2*step):
+            received = acc[i+step].send_to(order[i])
+            acc[i] = received if acc[i] is None else acc[i] + received
+        steps.append(step)
+        step *= 2
+
+    # Broadcast: the same tree, in reverse
+    if to is None:
+        for step in reversed(steps):
+            count_round()
+            for i in range(0, len(order) - step, 2*step): acc[i+step] = acc[i].send_to(order[i+step])
+    return acc[0]
+
+def _reduce_scatter(shares, to):
+    '''Each machine adds up one slice of the TensorShares (reduce-scatter), and sends its slice of the sum
+       to every machine, or only to `to` (all-gather), in 2 rounds.'''
+    machines = [share.owner for share in shares]
+    first = shares[0]
+    size, n = first.value.size, len(machines)
+    bounds = [size * i // n for i in range(n + 1)]
+    sliced = lambda share, i: type(share)(share.value.reshape(-1)[bounds[i]:bounds[i+1]], share.owner, share.Q)
+
+    # Reduce-scatter: machine i receives slice i of every share, and adds them up
+    count_round()
+    sums = [sum(sliced(share, i).send_to(machine) for share in shares) for i, machine in enumerate(machines)]
+
+    # All-gather: every machine receives every slice of the sum
+    count_round()
+    receivers = [to] if to is not None else machines
+    gathered = [[part.send_to(receiver) for part in sums] for receiver in receivers]
+    value = np.concatenate([part.value for part in gathered[0]]).reshape(first.shape)
+    return type(first)(value, receivers[0], first.Q)
+
+_STRATEGIES = {'all_to_all': _all_to_all, 'king': _king, 'tree': _tree, 'reduce_scatter': _reduce_scatter}
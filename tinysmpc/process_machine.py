@@ -0,0 +1,258 @@
+# This module defines ProcessMachine, a VirtualMachine that runs as a separate OS process.
+#
+# Normally, all VirtualMachines live in one Python process, and "sending" a Share
+# to another machine just creates a new Python object. A ProcessMachine instead
+# starts a worker process that holds the *values* of all of its Shares. In this
+# process, each of its Shares is only a small handle (a RemoteShare) with an id:
+#
+#   - Arithmetic on a RemoteShare (+, -, *) sends a command to the worker, which
+#     computes the new share locally. Commands don't wait for a reply, so the
+#     workers of different machines compute in parallel, on different cores.
+#   - Sending a RemoteShare to another ProcessMachine makes the first worker send
+#     the value directly to the second worker, over a localhost socket.
+#   - Only reading a RemoteShare's value (e.g. at the end of a reconstruction)
+#     waits for a round trip to the worker.
+#   - When a RemoteShare is garbage collected, its id is queued, and the worker
+#     frees all of the queued values with the next command (so the garbage collector
+#     never writes to the pipe in the middle of another message).
+#
+# All messages use a compact binary encoding: a one-byte command, 8-byte share ids,
+# and values as fixed-width integers for their ring (see serialization.py).
+#
+# Since ProcessMachines just change where Shares are stored, everything else works
+# unchanged, e.g. PrivateScalar.share(), SharedScalar.reconstruct(), and all of the
+# arithmetic protocols:
+#
+#   with ProcessMachine('alice') as alice, ProcessMachine('bob') as bob:
+#       shared_a = PrivateScalar(5, alice).share([alice, bob])
+#       (shared_a * shared_a).reconstruct(bob)
+#
+# (Only Shares are stored remotely. PrivateScalars, and the arrays of TensorShares,
+#  still live in this process.)
+
+from .finite_ring import assert_is_element, mod
+from .profiler import count_send, count_share
+from .secret_sharing import Share
+from .serialization import pack_ring, pack_value, unpack_ring, unpack_value
+from .tinysmpc import VirtualMachine
+from collections import deque
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Client, Listener, wait
+from os import urandom
+from queue import Empty, Queue
+from struct import Struct
+from threading import Thread
+
+# Commands sent to workers (one byte each)
+STORE, ADD, ADD_PUB, MUL, MUL_PUB, SEND, GET, FREE, STOP = range(9)
+
+_cmd = Struct('<B')            # command
+_id = Struct('<Q')             # share id
+_len = Struct('<H')            # length prefix
+_port = Struct('<H')           # localhost port
+
+class RemoteShare(Share):
+    '''A Share whose value is stored in a ProcessMachine's worker process (see above).'''
+    __slots__ = ('id',)
+    is_remote = True  # (so that the ObjectStore doesn't read the value to measure its size)
+
+    def __init__(self, value, owner, Q=None):
+        assert_is_element(value, Q)
+        self.id = owner._new_id()
+        self.owner = owner
+        self.Q = Q
+        owner._send(_cmd.pack(STORE) + _id.pack(self.id) + pack_ring(Q) + pack_value(value, Q))
+        owner.objects.append(self)
+        count_share(self)
+
+    @property
+    def value(self):
+        '''Fetch the value of this share from the worker process.'''
+        return unpack_value(self.owner._request(_cmd.pack(GET) + _id.pack(self.id)), self.Q)
+
+    def send_to(self, owner):
+        '''Send a copy of a Share to a different owner/machine (directly between workers, if possible).'''
+        if owner is self.owner: return self + 0
+        count_send(self, owner)
+        if not isinstance(owner, ProcessMachine): return Share(self.value, owner, self.Q)
+        new_id = owner._new_id()
+        self.owner._send(_cmd.pack(SEND) + _id.pack(self.id) + _id.pack(new_id) + _port.pack(owner.port) + owner._authkey)
+        return RemoteShare._from_id(new_id, owner, self.Q)
+
+    def __add__(self, other):
+        '''Called by: self + other.'''
+        return self._compute(ADD, ADD_PUB, other)
+
+    def __mul__(self, other):
+        '''Called by: self * other.'''
+        return self._compute(MUL, MUL_PUB, other)
+
+    def __del__(self):
+        '''Free the value in the worker process too (with the owner's next command, see above).'''
+        try:
+            if self.owner.running: self.owner._freed.append(self.id)
+        except AttributeError: pass  # (e.g. during interpreter shutdown)
+
+    def __repr__(self):
+        return f'RemoteShare({self.value}, \'{self.owner.name}\', Q={self.Q})'
+
+    def _compute(self, cmd, cmd_pub, other):
+        '''Ask the worker to compute self (+ or *) other, and return the result as a new RemoteShare.'''
+        self._assert_can_operate(other)
+        new_id = self.owner._new_id()
+        if isinstance(other, int): operand = _pack_int(other); cmd = cmd_pub
+        else:                      operand = _id.pack(other.id)
+        self.owner._send(_cmd.pack(cmd) + _id.pack(new_id) + _id.pack(self.id) + operand)
+        return RemoteShare._from_id(new_id, self.owner, self.Q)
+
+    @staticmethod
+    def _from_id(id, owner, Q):
+        '''Create a handle for a value that the worker already has (or will receive).'''
+        share = object.__new__(RemoteShare)
+        share.id, share.owner, share.Q = id, owner, Q
+        owner.objects.append(share)
+        count_share(share)
+        return share
+
+class ProcessMachine(VirtualMachine):
+    '''A VirtualMachine whose Shares are stored and computed on in a separate OS process.'''
+    share_class = RemoteShare
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._authkey = urandom(16)
+        self._conn, worker_conn = Pipe()
+        self._process = Process(target=_worker_main, args=(worker_conn, self._authkey), name=f'tinysmpc-{name}', daemon=True)
+        self._process.start()
+        self.port = _port.unpack(self._conn.recv_bytes())[0]
+        self._next_id = 0
+        self._freed = deque()  # ids of garbage collected RemoteShares, to free in the worker
+        self.running = True
+
+    def shutdown(self):
+        '''Stop the worker process.'''
+        if not self.running: return
+        self.running = False
+        self._conn.send_bytes(_cmd.pack(STOP))
+        self._process.join()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _send(self, message):
+        '''Send a command to the worker, without waiting for it to finish.'''
+        assert self.running, f'ProcessMachine \'{self.name}\' has been shut down.'
+        if self._freed: self._conn.send_bytes(_cmd.pack(FREE) + b''.join(_id.pack(id) for id in _pop_all(self._freed)))
+        self._conn.send_bytes(message)
+
+    def _request(self, message):
+        '''Send a command to the worker, and wait for its reply.'''
+        self._send(message)
+        reply = self._conn.recv_bytes()
+        assert reply[0] == 0, reply[1:].decode()
+        return reply[1:]
+
+def _pop_all(queue):
+    '''Pop the items of a deque, including any that are appended meanwhile (e.g. by the garbage collector).'''
+    while queue: yield queue.popleft()
+
+# The binary encoding of rings and values is the same as in serialization.py.
+# A public integer is a length-prefixed signed integer.
+
+def _pack_int(n):
+    n_bytes = (n.bit_length() + 8) // 8
+    return _len.pack(n_bytes) + n.to_bytes(n_bytes, 'little', signed=True)
+
+def _unpack_int(buf, offset):
+    n_bytes = _len.unpack_from(buf, offset)[0]
+    offset += _len.size
+    return int.from_bytes(buf[offset:offset+n_bytes], 'little', signed=True)
+
+# The worker process
+
+def _worker_main(conn, authkey):
+    '''The main loop of a ProcessMachine's worker: it executes commands from the controlling process,
+       and receives values from other workers.'''
+    listener = Listener(('localhost', 0), authkey=authkey)
+    conn.send_bytes(_port.pack(listener.address[1]))
+
+    # Accept connections from other workers in the background
+    new_peers = Queue()
+    Thread(target=_accept_forever, args=(listener, new_peers), daemon=True).start()
+    peers, clients = [], {}
+
+    values = {}  # id -> (value, Q)
+    freed = set()  # ids that were freed before they arrived from another worker
+    error = None
+
+    def receive(timeout):
+        '''Receive any values sent by other workers.'''
+        while True:
+            try: peers.append(new_peers.get_nowait())
+            except Empty: break
+        for peer in wait(peers, timeout) if peers else []:
+            try: buf = peer.recv_bytes()
+            except EOFError: peers.remove(peer); continue
+            new_id = _id.unpack_from(buf)[0]
+            Q, offset = unpack_ring(buf, _id.size)
+            if new_id in freed: freed.discard(new_id)
+            else: values[new_id] = (unpack_value(buf, Q, offset), Q)
+
+    def get(id):
+        '''Returns the (value, Q) of a share, waiting for it to arrive from another worker if needed.'''
+        while id not in values: receive(0.01)
+        return values[id]
+
+    while True:
+        if not conn.poll(0.01 if peers or not new_peers.empty() else 0.05):
+            receive(0)
+            continue
+        buf = conn.recv_bytes()
+        cmd = buf[0]
+        try:
+            if cmd == STOP: break
+            id = _id.unpack_from(buf, 1)[0]
+            if cmd == STORE:
+                Q, offset = unpack_ring(buf, 1 + _id.size)
+                values[id] = (unpack_value(buf, Q, offset), Q)
+            elif cmd in (ADD, MUL, ADD_PUB, MUL_PUB):
+                value, Q = get(_id.unpack_from(buf, 1 + _id.size)[0])
+                if cmd in (ADD_PUB, MUL_PUB): other = _unpack_int(buf, 1 + 2*_id.size)
+                else:                         other = get(_id.unpack_from(buf, 1 + 2*_id.size)[0])[0]
+                result = value + other if cmd in (ADD, ADD_PUB) else value * other
+                values[id] = (mod(result, Q), Q)
+            elif cmd == SEND:
+                value, Q = get(id)
+                new_id = _id.unpack_from(buf, 1 + _id.size)[0]
+                port = _port.unpack_from(buf, 1 + 2*_id.size)[0]
+                if port not in clients: clients[port] = Client(('localhost', port), authkey=buf[1 + 2*_id.size + _port.size:])
+                clients[port].send_bytes(_id.pack(new_id) + pack_ring(Q) + pack_value(value, Q))
+            elif cmd == GET:
+                if error is not None: raise AssertionError(error)
+                value, Q = get(id)
+                conn.send_bytes(b'\x00' + pack_value(value, Q))
+            elif cmd == FREE:  # (of any number of ids)
+                for (id,) in _id.iter_unpack(buf[1:]):
+                    if values.pop(id, None) is None: freed.add(id)
+        except Exception as e:
+            # Report the (first) error at the next GET, and make sure nobody waits for the missing value
+            error = error or f'{type(e).__name__}: {e}'
+            if cmd in (STORE, ADD, ADD_PUB, MUL, MUL_PUB): values[id] = (None, None)
+            if cmd == GET: conn.send_bytes(b'\x01' + error.encode())
+
+    for client in clients.values(): client.close()
+    listener.close()
+
+def _accept_forever(listener, new_peers):
+    '''Accept connections from other workers, and hand them to the main loop.'''
+    while True:
+        try: new_peers.put(listener.accept())
+        except OSError: return  # (the listener was closed)
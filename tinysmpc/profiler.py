@@ -0,0 +1,149 @@
+# This module defines a Profiler, which measures what an SMPC computation costs.
+#
+# While a Profiler is active, TinySMPC counts, for each protocol operation
+# (add_2sh, mult_2sh, greater_than, n_to_shares, n_from_shares, etc.):
+#   - the number of calls, and their wall-clock time
+#   - the number of shares created
+#   - the number of shares sent between machines (i.e. messages)
+#   - the number of reconstruction rounds
+#   - the estimated number of bytes sent over the wire
+#
+#   with Profiler() as profiler:
+#       shared_res = shared_a * shared_b + shared_c
+#   print(profiler.summary())
+#   profiler.save_trace('trace.json')  # Open in chrome://tracing or https://ui.perfetto.dev
+#
+# Operations call each other (e.g. mult_2sh calls n_to_shares and n_from_shares),
+# so the counts are always attributed to the innermost operation that's running,
+# while the time of an operation includes the operations it calls.
+#
+# Each thread has its own stack of running operations, and work handed to a PartyExecutor's
+# workers is attributed to the operation that handed it over (see executor.py).
+
+from .finite_ring import element_size
+from functools import wraps
+from contextlib import contextmanager
+from json import dump
+from threading import Lock, get_ident
+from time import perf_counter
+
+_profilers = []  # The active Profilers
+
+class Profiler():
+    '''Counts the shares, messages, rounds, bytes, and time of each protocol operation (see above).'''
+    COUNTERS = ('calls', 'shares', 'sends', 'rounds', 'bytes')
+
+    def __init__(self):
+        self.stats = {}    # Operation name -> {counter name -> value, 'time' -> seconds}
+        self.events = []   # Chrome trace events, one per operation call
+        self._stacks = {}  # Thread id -> the operations that are currently running in it, as [name, start time]
+        self._lock = Lock()
+        self._start = None
+
+    def __enter__(self):
+        if self._start is None: self._start = perf_counter()
+        _profilers.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _profilers.remove(self)
+
+    def summary(self):
+        '''Returns a table of the stats of each operation, as a string.'''
+        header = ['operation', *self.COUNTERS, 'time (ms)']
+        rows = [[name] + [str(stats[c]) for c in self.COUNTERS] + [f'{stats["time"] * 1000:.3f}']
+                for name, stats in sorted(self.stats.items(), key=lambda item: -item[1]['time'])]
+        widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+        lines = [' | '.join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in enumerate(zip(row, widths)))
+                 for row in [header] + rows]
+        lines.insert(1, '-+-'.join('-' * w for w in widths))
+        return '\n'.join(lines)
+
+    def totals(self):
+        '''Returns the total of each counter over all operations.'''
+        return {c: sum(stats[c] for stats in self.stats.values()) for c in self.COUNTERS}
+
+    def trace(self):
+        '''Returns the timeline of operation calls in the Chrome trace event format [1].
+           [1] https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU'''
+        return {'traceEvents': self.events, 'displayTimeUnit': 'ms'}
+
+    def save_trace(self, path):
+        '''Save the timeline of operation calls as a JSON file (see trace()).'''
+        with open(path, 'w') as f: dump(self.trace(), f)
+
+    @property
+    def _stack(self):
+        '''The operations that are currently running in this thread.'''
+        return self._stacks.setdefault(get_ident(), [])
+
+    def _stats_of(self, name):
+        if name not in self.stats: self.stats[name] = {**dict.fromkeys(self.COUNTERS, 0), 'time': 0.0}
+        return self.stats[name]
+
+    def _count(self, counter, n=1):
+        '''Add n to a counter of the innermost running operation.'''
+        stack = self._stack
+        name = stack[-1][0] if stack else '(top level)'
+        with self._lock: self._stats_of(name)[counter] += n
+
+def profiled(name):
+    '''Decorator for a protocol operation, so that the active Profilers measure it.'''
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _profilers: return fn(*args, **kwargs)
+            profilers = list(_profilers)
+            for profiler in profilers:
+                with profiler._lock: profiler._stats_of(name)['calls'] += 1
+                profiler._stack.append([name, perf_counter()])
+            try: return fn(*args, **kwargs)
+            finally:
+                end = perf_counter()
+                for profiler in profilers:
+                    _, start = profiler._stack.pop()
+                    with profiler._lock:
+                        profiler._stats_of(name)['time'] += end - start
+                        profiler.events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': get_ident(),
+                                                'ts': (start - profiler._start) * 1e6, 'dur': (end - start) * 1e6})
+        return wrapper
+    return decorator
+
+def running_operations():
+    '''Returns the operations that are running in this thread, for each active Profiler (see running_as).'''
+    return [(profiler, list(profiler._stack)) for profiler in _profilers]
+
+@contextmanager
+def running_as(operations):
+    '''Attribute the counts in this thread to operations (from running_operations() in another thread).'''
+    ident = get_ident()
+    for profiler, stack in operations: profiler._stacks[ident] = list(stack)
+    try: yield
+    finally:
+        for profiler, _ in operations: profiler._stacks.pop(ident, None)
+
+def count_share(share):
+    '''Called whenever a Share (or TensorShare) is created.'''
+    for profiler in _profilers: profiler._count('shares', _n_elements(share))
+
+def count_send(share, owner):
+    '''Called whenever a Share (or TensorShare) is sent to a machine (which is free if it's the same machine).'''
+    if owner is share.owner: return
+    for profiler in _profilers:
+        profiler._count('sends')
+        profiler._count('bytes', _n_elements(share) * element_size(share.Q))
+
+def count_deal(dealer, owner, n_bytes):
+    '''Called whenever a dealer sends a new share (or a seed for it, see secret_sharing.py) to a machine.'''
+    if dealer is None or dealer is owner: return
+    for profiler in _profilers:
+        profiler._count('sends')
+        profiler._count('bytes', n_bytes)
+
+def count_round():
+    '''Called whenever a value is reconstructed (i.e. one round of communication).'''
+    for profiler in _profilers: profiler._count('rounds')
+
+def _n_elements(share):
+    '''The number of ring elements in a Share (1) or TensorShare (its size).'''
+    return getattr(share.value, 'size', 1) if not getattr(share, 'is_remote', False) else 1
@@ -0,0 +1,118 @@
+# This module defines a RoundScheduler, which runs SMPC protocols as asyncio
+# coroutines [1], so that independent operations share communication rounds.
+#
+# In the normal (synchronous) API, every protocol opens its own values. For example,
+# mult_2sh opens sh1 - a and sh2 - b together, but `a*b + c*d` still runs the two
+# multiplications one after another: that's 2 rounds of communication, where 1 would do.
+# Under real network latency, the number of rounds dominates.
+#
+# With a RoundScheduler, a protocol step *awaits* the values it needs to open:
+#
+#   scheduler = RoundScheduler()
+#
+#   async def f(a, b, c, d):
+#       ab, cd = await scheduler.gather(scheduler.mult(a, b), scheduler.mult(c, d))
+#       return ab + cd
+#
+#   scheduler.run(f(a, b, c, d))  # Only 1 round!
+#
+# The scheduler keeps track of which coroutines are still computing locally. Once
+# every one of them is waiting (for an opening, or for its sub-operations), it opens
+# all of the pending values together, in one communication round, and resumes them.
+#
+# [1] https://docs.python.org/3/library/asyncio.html
+
+from .finite_ring import np
+from .shared_multiplication import _open_together, _shared_tensor_triple, _shared_triple
+from threading import Thread
+import asyncio
+
+class RoundScheduler():
+    '''Runs protocol coroutines, and merges all of their pending openings into one round per layer.'''
+    def __init__(self):
+        self.rounds = 0      # Number of communication rounds so far
+        self.n_opened = 0    # Number of SharedScalars/SharedTensors opened so far
+        self._pending = []   # (SharedScalar or SharedTensor, future) pairs to open in the next round
+        self._n_waiting = 0  # Number of coroutines waiting for the next round
+        self._active = 0     # Number of coroutines that are computing (i.e. not waiting)
+
+    def run(self, *coros):
+        '''Run coroutines to completion, and return their results (a list, if there's more than one).'''
+        async def main(): return await self.gather(*coros)
+        self._active = 1
+        try: asyncio.get_running_loop()
+        except RuntimeError: results = asyncio.run(main())
+        else: results = _run_in_thread(main())  # (e.g. in a Jupyter notebook, which already runs an event loop)
+        return results[0] if len(coros) == 1 else results
+
+    async def gather(self, *coros):
+        '''Run coroutines concurrently (so their openings can share rounds), and return a list of their results.'''
+        if not coros: return []
+        group = [len(coros)]
+        self._active += len(coros) - 1  # The children start computing, while this coroutine waits for them
+        tasks = [asyncio.ensure_future(self._child(coro, group)) for coro in coros]
+        return list(await asyncio.gather(*tasks))
+
+    async def open(self, *shared):
+        '''Wait for the next round, and return the public value(s) of one or more SharedScalars/SharedTensors.'''
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in shared]
+        self._pending.extend(zip(shared, futures))
+        self._n_waiting += 1
+        self._active -= 1
+        self._maybe_flush()
+        values = [await future for future in futures]
+        return values[0] if len(values) == 1 else tuple(values)
+
+    async def mult(self, sh1, sh2):
+        '''Implements mult_2sh (or mult_2tsh) as a coroutine, where sh1 - a and sh2 - b are opened in the same round.'''
+        sh1._assert_can_operate(sh2)
+        if hasattr(sh1, 'shape'): shared_a, shared_b, shared_c = _shared_tensor_triple(sh1, sh2)
+        else:                     shared_a, shared_b, shared_c = _shared_triple(sh1)
+        sh1_m_a, sh2_m_b = await self.open(sh1 - shared_a, sh2 - shared_b)
+        return shared_c + (sh1_m_a * shared_b) + (sh2_m_b * shared_a) + (sh1_m_a * sh2_m_b)
+
+    async def _child(self, coro, group):
+        '''Run one coroutine of a gather(), and keep track of when it stops computing.'''
+        try: return await coro
+        finally:
+            group[0] -= 1
+            if group[0] > 0: self._active -= 1  # (The last child hands its slot back to the waiting parent)
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        '''If every coroutine is waiting, run one communication round.'''
+        if self._active > 0 or not self._pending: return
+        pending, self._pending = self._pending, []
+        values = _open_all([shared for shared, _ in pending])
+        self.rounds += 1
+        self.n_opened += len(pending)
+        self._active += self._n_waiting
+        self._n_waiting = 0
+        for (_, future), value in zip(pending, values): future.set_result(value)
+
+def _open_all(shared_values):
+    '''Open a list of SharedScalars/SharedTensors in a single round.
+       Each machine sends all of its shares at once: we join the shares of the values on the same
+       machines and ring into one TensorShare per machine (when NumPy is available), and open that.'''
+    if np is None: return [shared.open() for shared in shared_values]
+    values = [None] * len(shared_values)
+    groups = {}
+    for i, shared in enumerate(shared_values):
+        groups.setdefault((frozenset(shared.owners), shared.Q), []).append(i)
+    for indices in groups.values():
+        opened = _open_together(*[shared_values[i] for i in indices])
+        for i, value in zip(indices, opened): values[i] = value
+    return values
+
+def _run_in_thread(coro):
+    '''Run a coroutine with asyncio.run() in a new thread, and return its result.'''
+    result = {}
+    def target():
+        try: result['value'] = asyncio.run(coro)
+        except BaseException as e: result['error'] = e
+    thread = Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result: raise result['error']
+    return result['value']
@@ -1,8 +1,18 @@
 # This module defines how additive secret sharing works in TinySMPC:
 #  - how to create secret shares from a number
-#  - how to reconstruct the number from the shares
+#  - how to reconstruct the number from the shares (see opening.py for how the shares are sent)
 #  - the internal Share class that represents a single secret share
 #
+#  - the same three things for whole arrays of numbers (TensorShare), 
+#    where each machine holds one contiguous array of shares
+#
+# All but one of the shares are uniformly random, so for arrays, the dealer doesn't
+# send them at all: it sends each machine a short PRG seed instead, from which the
+# machine expands its share itself. Only the last share (the "correction" share, 
+# which makes the shares add up to the secret) is sent in full [4]. This divides
+# the traffic of sharing an array by about the number of machines. (If the dealer
+# is one of the machines, it keeps the correction share, so only seeds are sent.)
+#
 # We use the simple additive secret sharing scheme that's compatible
 # with SPDZ. This is sort of a well-known "obvious" scheme, so has 
 # no canonical citation [1].
@@ -12,22 +22,39 @@
 # [1] https://crypto.stackexchange.com/questions/68666/reference-for-additive-secret-sharing
 # [2] https://mortendahl.github.io/2017/06/04/secret-sharing-part1/
 # [3] https://cs.nyu.edu/courses/spring07/G22.3033-013/scribe/lecture01.pdf
+# [4] Section 3.3 of https://eprint.iacr.org/2018/442.pdf
 
+from .executor import kernel_map
 from .fixed_point import fixed_point, float_point
-from .finite_ring import assert_is_element, mod, rand_element
+from .profiler import count_deal, count_send, count_share, profiled
+from .finite_ring import (assert_is_array_element, assert_is_element, element_size, from_ring_array, 
+                          matmul_array, mod, mod_array, np, rand_array, rand_bytes, rand_elements, ring_dtype, to_ring_array)
+from .opening import reconstruct_shares
+from itertools import repeat
+
+SEED_SIZE = 16  # Bytes per PRG seed
 
 class Share():
     '''A class that represents a secret share that belongs to a machine.
        It supports ring arithmetic with other Shares or integers (+, -, *).'''
+    __slots__ = ('value', 'owner', 'Q', '__weakref__')  # Machines create lots of Shares, so keep them small
+
+    def __new__(cls, value, owner, Q=None):
+        # Each machine decides which class its Shares are (e.g. ProcessMachines, see process_machine.py)
+        if cls is Share: cls = getattr(owner, 'share_class', Share)
+        return object.__new__(cls)
+
     def __init__(self, value, owner, Q=None):
         assert_is_element(value, Q)
         self.value = value
         self.owner = owner
         self.Q = Q
         owner.objects.append(self)
+        count_share(self)
         
     def send_to(self, owner):
         '''Send a copy of a Share to a different owner/machine.'''
+        count_send(self, owner)
         return Share(self.value, owner, self.Q)
     
     def __add__(self, other):
@@ -69,8 +96,10 @@ class Share():
         assert self.owner == other.owner, f'{self} and {other} do not have the same owners.'
         assert self.Q == other.Q, f'{self} and {other} are not over the same rings.'
 
-def n_to_shares(n, owners, Q=None):  
-    '''Create additive secret Shares for an integer n, split across a group of machines.'''
+@profiled('n_to_shares')
+def n_to_shares(n, owners, Q=None, dealer=None):  
+    '''Create additive secret Shares for an integer n, split across a group of machines.
+       dealer is the machine that knows n and sends out the Shares (if it's None, the Shares are free).'''
     # Make sure there are no duplicate owners (technically this is okay, but let's keep it simple)
     assert len(owners) == len(set(owners))
 
@@ -78,18 +107,130 @@ def n_to_shares(n, owners, Q=None):
     assert_is_element(n, Q)
 
     # Generate the value of each secret share using additive secret sharing
-    values = [rand_element(Q) for _ in owners[:-1]]
+    # (A seed would be as large as a single value, so we just send the values)
+    values = rand_elements(len(owners) - 1, Q)
     values.append(mod(n - sum(values), Q))
     
     # Give one secret Share to each machine
     shares = [Share(value, owner, Q) for value, owner in zip(values, owners)]
+    for owner in owners: count_deal(dealer, owner, element_size(Q))
     
     return shares
 
-def n_from_shares(shares, owner, Q=None):
-    '''Given a list of additive secret Shares, reconstruct the integer value they're hiding.'''
-    # First, move all shares onto one machine
-    local_shares = [share.send_to(owner) for share in shares]
-    
-    # Now, reconstruct the original value (we just add the shares!)
-    return sum(local_shares).value
\ No newline at end of file
+@profiled('n_from_shares')
+def n_from_shares(shares, owner, Q=None, strategy=None):
+    '''Given a list of additive secret Shares, reconstruct the integer value they're hiding on one machine.'''
+    # Move all of the shares onto one machine, and add them up (strategy is how they get there, see opening.py)
+    return reconstruct_shares(shares, owner, Q, strategy)
+
+class TensorShare():
+    '''A class that represents a whole array of secret shares that belongs to a machine.
+       It supports elementwise ring arithmetic with other TensorShares or public integers/arrays (+, -, *).
+       (The values are stored as a ring array, see finite_ring.py.)'''
+    __array_ufunc__ = None  # Make NumPy defer to our operators, e.g. for: np.array(...) + self
+    __slots__ = ('value', 'owner', 'Q', '__weakref__')
+
+    def __init__(self, value, owner, Q=None):
+        if not isinstance(value, np.ndarray): value = np.asarray(value, dtype=ring_dtype(Q))  # (NumPy turns 0-d results into scalars)
+        self.value = value
+        self.owner = owner
+        self.Q = Q
+        owner.objects.append(self)
+        count_share(self)
+
+    @property
+    def shape(self):
+        return self.value.shape
+
+    def send_to(self, owner):
+        '''Send a copy of a TensorShare to a different owner/machine.'''
+        count_send(self, owner)
+        return TensorShare(self.value.copy(), owner, self.Q)
+
+    def __add__(self, other):
+        '''Called by: self + other.'''
+        return TensorShare(mod_array(self.value + self._other_value(other), self.Q), self.owner, self.Q)
+
+    def __radd__(self, other):
+        '''Called by: other + self (when other is not a TensorShare).'''
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        '''Called by: self - other.'''
+        return TensorShare(mod_array(self.value - self._other_value(other), self.Q), self.owner, self.Q)
+
+    def __rsub__(self, other):
+        '''Called by: other - self (when other is not a TensorShare).'''
+        return TensorShare(mod_array(self._other_value(other) - self.value, self.Q), self.owner, self.Q)
+
+    def __mul__(self, other):
+        '''Called by: self * other.'''
+        return TensorShare(mod_array(self.value * self._other_value(other), self.Q), self.owner, self.Q)
+
+    def __rmul__(self, other):
+        '''Called by: other * self (when other is not a TensorShare).'''
+        return self.__mul__(other)
+
+    def __matmul__(self, other):
+        '''Called by: self @ other. Only implemented when other is a public array.'''
+        assert not isinstance(other, TensorShare), 'Multiplying two shares would not give a share of the product (see matmul_2tsh).'
+        return TensorShare(matmul_array(self.value, self._other_value(other), self.Q), self.owner, self.Q)
+
+    def __rmatmul__(self, other):
+        '''Called by: other @ self (when other is a public array).'''
+        return TensorShare(matmul_array(self._other_value(other), self.value, self.Q), self.owner, self.Q)
+
+    def __repr__(self):
+        return f'TensorShare({from_ring_array(self.value, self.Q).tolist()}, \'{self.owner.name}\', Q={self.Q})'
+
+    def _other_value(self, other):
+        '''Returns the ring array of other (a TensorShare, or a public integer/array), after checking it's compatible.'''
+        if not isinstance(other, TensorShare): return to_ring_array(other, self.Q)  # It's okay to do operations with any public integers or arrays
+        assert self.owner == other.owner, f'{self} and {other} do not have the same owners.'
+        assert self.Q == other.Q, f'{self} and {other} are not over the same rings.'
+        return other.value
+
+@profiled('tensor_to_shares')
+def tensor_to_shares(values, owners, Q=None, dealer=None):
+    '''Create additive secret TensorShares for an array of integers, split across a group of machines.
+       This is n_to_shares, but all but one of the shares are expanded from PRG seeds (see above).'''
+    assert len(owners) == len(set(owners))
+    assert_is_array_element(values, Q)
+
+    # The dealer keeps the correction share, if it's one of the owners
+    ring_values = to_ring_array(values, Q)
+    seeds, share_values = split_array_seeded(ring_values, len(owners), Q)
+    i_correction = owners.index(dealer) if dealer in owners else len(owners) - 1
+    share_values.insert(i_correction, share_values.pop())
+
+    # Give one secret TensorShare to each machine (which expands its seed into its share, if it got one)
+    for i, owner in enumerate(owners):
+        count_deal(dealer, owner, ring_values.size * element_size(Q) if i == i_correction else SEED_SIZE)
+    return [TensorShare(value, owner, Q) for value, owner in zip(share_values, owners)]
+
+def split_array(ring_values, n_shares, Q=None, rng=None):
+    '''Generate the values of n_shares additive secret shares of a ring array (as ring arrays).'''
+    share_values = [rand_array(ring_values.shape, Q, rng) for _ in range(n_shares - 1)]
+    share_values.append(mod_array(ring_values - mod_array(sum(share_values), Q), Q))
+    return share_values
+
+def split_array_seeded(ring_values, n_shares, Q=None):
+    '''Like split_array, but the first n_shares - 1 shares are expanded from new random PRG seeds.
+       Returns the seeds, and the values of all of the shares (where the last one is the correction share).'''
+    seeds = [new_seed() for _ in range(n_shares - 1)]
+    share_values = kernel_map(expand_seed, seeds, repeat(ring_values.shape), repeat(Q), size=ring_values.size)  # (one per machine)
+    share_values.append(mod_array(ring_values - mod_array(sum(share_values), Q), Q))
+    return seeds, share_values
+
+def new_seed():
+    '''Returns a new random PRG seed (a SEED_SIZE-byte integer).'''
+    return int.from_bytes(rand_bytes(SEED_SIZE), 'little')
+
+def expand_seed(seed, shape, Q=None):
+    '''Deterministically expand a PRG seed into a random ring array (the same one for the same seed).'''
+    return rand_array(shape, Q, rng=np.random.Generator(np.random.Philox(key=seed)))
+
+@profiled('tensor_from_shares')
+def tensor_from_shares(shares, owner, Q=None, strategy=None):
+    '''Given a list of additive secret TensorShares, reconstruct the array of integers they're hiding on one machine.'''
+    return reconstruct_shares(shares, owner, Q, strategy)
@@ -0,0 +1,181 @@
+# This module defines a compact binary format for shares, so that they can be
+# stored on disk, or sent between processes, without any parsing or copying.
+#
+# Each record holds the shares of one machine: a Share, a list of Shares, or a TensorShare.
+# It's a small header, followed by the values as packed fixed-width integers:
+#
+#   magic    4 bytes    b'TSMP'
+#   version  1 byte
+#   kind     1 byte     SHARE, SHARE_LIST, or TENSOR_SHARE
+#   ndim     1 byte     (for TensorShares)
+#   (unused) 1 byte
+#   count    8 bytes    number of values
+#   owner    2-byte length + UTF-8 name of the owner machine
+#   ring     2-byte length + Q as an unsigned integer (length 0 means the int64 ring)
+#   shape    8 bytes per dimension (for TensorShares)
+#   (padding to a multiple of 8 bytes)
+#   values   count * width bytes, little-endian
+#
+# The width of a value is 8 bytes in the int64 ring (its 64-bit pattern) and in prime
+# rings whose ring arrays are int64s; so the values are laid out exactly like a ring array
+# (see finite_ring.py), and a TensorShare can be decoded as a NumPy view of the buffer
+# (e.g. a memoryview, or a memory-mapped file), without copying. Larger prime rings use
+# just enough bytes for Q, and are decoded into object arrays.
+#
+#   save('alice.tsmp', [shared_x.share_of[alice], triple_a.share_of[alice]])
+#   share_x, share_a = load('alice.tsmp', alice)  # Memory-mapped, so this is instant
+#
+#   buffers = encode_shared(shared_x)  # {machine: bytes}, e.g. to send to each machine
+#   shared_x = decode_shared(buffers)
+
+from .finite_ring import MAX_INT64, element_size, np, ring_dtype
+from .secret_sharing import Share, TensorShare
+from os.path import getsize
+from struct import Struct
+
+MAGIC = b'TSMP'
+VERSION = 1
+SHARE, SHARE_LIST, TENSOR_SHARE = range(3)
+
+_header = Struct('<4sBBBxQ')  # magic, version, kind, ndim, count
+_len = Struct('<H')
+_dim = Struct('<Q')
+
+def encode(obj):
+    '''Encode a Share, a list of Shares (of one machine, over one ring), or a TensorShare as bytes.'''
+    buf = bytearray(encoded_size(obj))
+    encode_into(obj, memoryview(buf))
+    return bytes(buf)
+
+def encoded_size(obj):
+    '''Returns the number of bytes that encode(obj) takes.'''
+    kind, owner, Q, shape, count = _describe(obj)
+    return _values_offset(owner, Q, shape) + count * value_width(Q)
+
+def encode_into(obj, buf, offset=0):
+    '''Encode a Share, list of Shares, or TensorShare into a writable buffer (e.g. a memoryview) at offset.
+       Returns the offset where the record ends.'''
+    kind, owner, Q, shape, count = _describe(obj)
+    width = value_width(Q)
+    start = offset
+    _header.pack_into(buf, offset, MAGIC, VERSION, kind, len(shape), count)
+    offset += _header.size
+    name, ring = owner.name.encode(), pack_ring(Q)
+    _len.pack_into(buf, offset, len(name))
+    buf[offset+_len.size:offset+_len.size+len(name)] = name
+    offset += _len.size + len(name)
+    buf[offset:offset+len(ring)] = ring
+    offset += len(ring)
+    for dim in shape:
+        _dim.pack_into(buf, offset, dim)
+        offset += _dim.size
+    offset = start + _padded(offset - start)
+    buf[offset:offset+count*width] = _pack_values(obj, kind, Q)
+    return offset + count * width
+
+def decode(buf, owner, offset=0):
+    '''Decode the record at offset in a buffer (bytes, memoryview, mmap, ...) into shares that belong to owner.
+       A TensorShare's value is a view of the buffer (no copy) when possible. Returns (shares, end offset).'''
+    magic, version, kind, ndim, count = _header.unpack_from(buf, offset)
+    assert magic == MAGIC, f'This is not a TinySMPC record (found {bytes(magic)}, not {MAGIC}).'
+    assert version == VERSION, f'Unsupported record version {version}.'
+    start = offset
+    offset += _header.size
+    n_bytes = _len.unpack_from(buf, offset)[0]
+    name = bytes(buf[offset+_len.size:offset+_len.size+n_bytes]).decode()
+    Q, offset = unpack_ring(buf, offset + _len.size + n_bytes)
+    assert name == owner.name, f'These shares belong to \'{name}\', not \'{owner.name}\'.'
+    shape = tuple(_dim.unpack_from(buf, offset + i * _dim.size)[0] for i in range(ndim))
+    offset = start + _padded(offset + ndim * _dim.size - start)
+    end = offset + count * value_width(Q)
+
+    if kind == TENSOR_SHARE:
+        return TensorShare(_unpack_array(buf, offset, count, Q).reshape(shape), owner, Q), end
+    values = [unpack_value(buf, Q, offset + i * value_width(Q)) for i in range(count)]
+    shares = [Share(value, owner, Q) for value in values]
+    return (shares[0] if kind == SHARE else shares), end
+
+def decode_all(buf, owner):
+    '''Decode all of the records in a buffer, as a list.'''
+    objs, offset = [], 0
+    while offset < len(buf):
+        obj, offset = decode(buf, owner, offset)
+        objs.append(obj)
+    return objs
+
+def save(path, objs):
+    '''Save a list of shares of one machine (Shares, lists of Shares, or TensorShares) to a file.'''
+    with open(path, 'wb') as f:
+        for obj in objs: f.write(encode(obj))
+
+def load(path, owner, mmap=True):
+    '''Load the shares in a file (see save) for owner.
+       With mmap, the file is memory-mapped: TensorShares are views of the file, which are only read from disk when used.'''
+    if mmap and np is not None and getsize(path) == 0: buf = b''  # (an empty file can't be memory-mapped)
+    elif mmap and np is not None: buf = memoryview(np.memmap(path, dtype=np.uint8, mode='r'))
+    else:
+        with open(path, 'rb') as f: buf = f.read()
+    return decode_all(buf, owner)
+
+def encode_shared(shared):
+    '''Encode a SharedScalar or SharedTensor as a dict of {machine: bytes of its share}.'''
+    return {share.owner: encode(share) for share in shared.shares}
+
+def decode_shared(buffers):
+    '''Decode a SharedScalar or SharedTensor from a dict of {machine: buffer of its share} (see encode_shared).'''
+    from .tinysmpc import SharedScalar, SharedTensor
+    shares = [decode(buf, owner)[0] for owner, buf in buffers.items()]
+    shared_class = SharedTensor if isinstance(shares[0], TensorShare) else SharedScalar
+    return shared_class(shares, shares[0].Q)
+
+# Rings and values (also used by ProcessMachine's messages, see process_machine.py)
+
+def value_width(Q=None):
+    '''Returns the number of bytes of one packed value in the int64 ring, or the size-Q prime ring.'''
+    return 8 if Q is None or (Q - 1)**2 <= MAX_INT64 else element_size(Q)  # (i.e. if its ring arrays are 8 bytes wide)
+
+def pack_ring(Q):
+    '''Pack a ring as a length-prefixed unsigned integer (length 0 means the int64 ring).'''
+    if Q is None: return _len.pack(0)
+    n_bytes = element_size(Q)
+    return _len.pack(n_bytes) + Q.to_bytes(n_bytes, 'little')
+
+def unpack_ring(buf, offset):
+    '''Unpack a ring packed with pack_ring at offset. Returns (Q, end offset).'''
+    n_bytes = _len.unpack_from(buf, offset)[0]
+    offset += _len.size
+    Q = int.from_bytes(bytes(buf[offset:offset+n_bytes]), 'little') if n_bytes else None
+    return Q, offset + n_bytes
+
+def pack_value(value, Q):
+    '''Pack an element of the ring as a fixed-width integer.'''
+    return value.to_bytes(value_width(Q), 'little', signed=Q is None)
+
+def unpack_value(buf, Q, offset=0):
+    '''Unpack an element of the ring packed with pack_value at offset.'''
+    return int.from_bytes(bytes(buf[offset:offset+value_width(Q)]), 'little', signed=Q is None)
+
+def _describe(obj):
+    '''Returns the (kind, owner, Q, shape, count) of a Share, list of Shares, or TensorShare.'''
+    if isinstance(obj, TensorShare): return TENSOR_SHARE, obj.owner, obj.Q, obj.shape, obj.value.size
+    if isinstance(obj, Share):       return SHARE, obj.owner, obj.Q, (), 1
+    assert len(obj) > 0 and all(isinstance(share, Share) for share in obj), 'Only Shares, lists of Shares, and TensorShares can be encoded.'
+    assert all(share.owner is obj[0].owner and share.Q == obj[0].Q for share in obj), 'All Shares in a list must have the same owner and ring.'
+    return SHARE_LIST, obj[0].owner, obj[0].Q, (), len(obj)
+
+def _values_offset(owner, Q, shape):
+    return _padded(_header.size + _len.size + len(owner.name.encode()) + len(pack_ring(Q)) + len(shape) * _dim.size)
+
+def _padded(n):
+    return (n + 7) // 8 * 8
+
+def _pack_values(obj, kind, Q):
+    if kind != TENSOR_SHARE:
+        return b''.join(pack_value(share.value, Q) for share in ([obj] if kind == SHARE else obj))
+    if ring_dtype(Q) is not object: return np.asarray(obj.value, dtype=obj.value.dtype.newbyteorder('<')).tobytes()
+    return b''.join(pack_value(int(value), Q) for value in obj.value.ravel().tolist())
+
+def _unpack_array(buf, offset, count, Q):
+    dtype = np.dtype(ring_dtype(Q))
+    if dtype != object: return np.frombuffer(buf, dtype=dtype.newbyteorder('<'), count=count, offset=offset)
+    return np.array([unpack_value(buf, Q, offset + i * value_width(Q)) for i in range(count)], dtype=object)
@@ -16,14 +16,21 @@
 # we can use `type(sh)` to get access to the SharedScalar class &
 # constructor.
 
+from .executor import party_map
+from .profiler import profiled
+from operator import add
+
+@profiled('add_2sh')
 def add_2sh(sh1, sh2):
     '''Implements addition on two SharedScalars.'''
-    # To do the addition, we add each machine's shares together
+    # To do the addition, we add each machine's shares together (in parallel, with a PartyExecutor)
     sh1._assert_can_operate(sh2)
-    sum_shares = [sh1.share_of[owner] + sh2.share_of[owner]
-                  for owner in sh1.owners]
+    owners = list(sh1.owners)
+    sum_shares = party_map(add, [sh1.share_of[owner] for owner in owners],
+                                [sh2.share_of[owner] for owner in owners])
     return type(sh1)(sum_shares, Q=sh1.Q)
 
+@profiled('add_sh_pub')
 def add_sh_pub(sh, pub):
     '''Implements addition on a SharedScalar and a public integer.'''
     # To do the addition, we add the integer to one (random) share only
@@ -0,0 +1,98 @@
+# This module defines secure bucketization (binning) of shared values by public thresholds,
+# and histograms built on it.
+#
+# Comparing a shared value with k public thresholds, one `x > t` at a time, would redo the
+# whole setup of PrivateCompare k times (see shared_comparison.py). Instead:
+#   1) The bitwise shares of x are computed once for all k thresholds. With cache=True, they're
+#      also kept on x, so later calls on x reuse them (see bitwise_shares). That costs L = 64
+#      times the memory of x's shares, so it's opt-in.
+#   2) Each machine repeats its bitwise shares once per threshold (a local operation), and
+#      all k comparisons (for every element of a SharedTensor) run as one batched
+#      PrivateCompare, with a single reconstruction.
+#   3) Like in msb(), the results stay secret-shared: PrivateCompare only tells the third
+#      machine P2 β' = β ^ [x > t], where β is random and public to the other machines.
+#      So P2 shares β', and the other machines XOR in β.
+#
+# With sorted thresholds t_0 <= ... <= t_{k-1}, the shared bits g_j = [x > t_j] go 1, ..., 1, 0, ..., 0,
+# so the bucket index of x is their sum (the number of thresholds below x, like np.searchsorted),
+# and the one-hot bucket indicators are differences of neighbouring bits. Both are local operations.
+#
+#   x_sh.bucketize([0, 10, 100])                # Bucket indices in 0..3, as a SharedTensor
+#   histogram(x_sh, [0, 10, 100]).open()        # array([count in [0, 10), count in [10, 100]])
+#
+# Bucket indices, indicators, and histogram counts all stay secret-shared, so they can be used
+# in further arithmetic (e.g. to sum another column per bucket), or opened or reconstructed.
+
+from .finite_ring import MIN_INT64, mod_array, np, to_ring_array
+from .profiler import profiled
+from .shared_comparison import L, _map_shares, _private_compare_batch_masked, bitwise_shares
+
+@profiled('compare_thresholds')
+def compare_thresholds(x_sh, thresholds, cache=False):
+    '''Compares a SharedScalar (or SharedTensor) x_sh > each of a list of public integer thresholds, in one batched
+       PrivateCompare. Returns a SharedTensor of shape (*x_sh.shape, k) of 0s and 1s that stay secret-shared.
+       With cache, x_sh keeps its bitwise shares for later calls (see above).'''
+    from .tinysmpc import PrivateTensor, VirtualMachine
+    thresholds = _integers(thresholds, 'Thresholds')
+    assert thresholds.ndim == 1 and thresholds.size > 0, 'Thresholds must be a non-empty list of integers'
+    machines = list(x_sh.owners)
+    shape = (*getattr(x_sh, 'shape', ()), thresholds.size)
+
+    # Each machine repeats its bitwise shares once per threshold
+    x_bits_sh = _map_shares(lambda v: np.broadcast_to(v[..., None, :], (*shape, L)), bitwise_shares(x_sh, cache))
+
+    # All of the comparisons at once, shifted into uint64s like in greater_than_batch
+    r = to_ring_array(np.broadcast_to(thresholds, shape)) ^ np.uint64(-MIN_INT64)
+    p2 = VirtualMachine('p2')
+    β, β_prime = _private_compare_batch_masked(x_bits_sh, r, p2)
+
+    # x > t is β ^ β', where P2 shares β', and β is public to the other machines: β ^ s = β + (1 - 2β) * s
+    s_sh = PrivateTensor(β_prime, p2).share(machines, x_sh.Q)
+    return (1 - 2*β) * s_sh + β
+
+@profiled('bucketize')
+def bucketize(x_sh, thresholds, one_hot=False, cache=False):
+    '''Returns the bucket index of a SharedScalar (or SharedTensor, elementwise) among sorted public thresholds,
+       i.e. the number of thresholds < x (like np.searchsorted), as a secret-shared value in [0, k].
+       With one_hot, returns secret-shared bucket indicators instead, with shape (*x_sh.shape, k + 1).
+       With cache, x_sh keeps its bitwise shares for later calls (see above).'''
+    thresholds = _integers(thresholds, 'Thresholds')
+    assert (thresholds[1:] >= thresholds[:-1]).all(), 'Thresholds must be sorted'  # (np.diff could overflow)
+    above_sh = compare_thresholds(x_sh, thresholds, cache)
+    Q = x_sh.Q
+    if not one_hot:
+        index_sh = _map_shares(lambda v: mod_array(v.sum(axis=-1), Q), above_sh)
+        return index_sh if hasattr(x_sh, 'shape') else index_sh.item()
+
+    # Indicator i is [x > t_{i-1}] - [x > t_i], where x > t_{-1} is always true, and x > t_k never is
+    padded_sh = _map_shares(lambda v: np.pad(v, [(0, 0)] * (v.ndim - 1) + [(1, 1)]), above_sh)
+    padded_sh = padded_sh + (np.arange(padded_sh.shape[-1]) == 0).astype(np.int64)
+    return _map_shares(lambda v: mod_array(v[..., :-1] - v[..., 1:], Q), padded_sh)
+
+@profiled('histogram')
+def histogram(shared_values, edges, cache=False):
+    '''Counts how many of the shared values fall into each bin between sorted public integer edges, like np.histogram:
+       the bins are [e_0, e_1), ..., [e_{m-2}, e_{m-1}], and values outside them aren't counted. shared_values is a
+       SharedTensor (of any shape), or a list of SharedScalars. Returns the m - 1 counts as a secret-shared SharedTensor.
+       With cache (and a SharedTensor), it keeps its bitwise shares for later calls (see above).'''
+    from .tinysmpc import SharedTensor
+    if isinstance(shared_values, list): shared_values = SharedTensor.stack(shared_values)
+    edges = _integers(edges, 'Edges')
+    assert edges.ndim == 1 and edges.size >= 2, 'A histogram needs at least 2 edges'
+    assert (edges[1:] > edges[:-1]).all(), 'Edges must be strictly increasing'  # (np.diff could overflow)
+    assert int(edges[0]) > MIN_INT64, f'Edges must be greater than {MIN_INT64} (x >= e is compared as x > e - 1, which would wrap around)'
+
+    # For integers, x >= e is x > e - 1. The last bin includes its right edge (x > e_{m-1} isn't counted)
+    above_sh = compare_thresholds(shared_values, np.append(edges[:-1] - 1, edges[-1]), cache)
+
+    # Count the values above each threshold (a local sum over the elements), and take differences
+    Q = shared_values.Q
+    counts_sh = _map_shares(lambda v: mod_array(v.reshape(-1, edges.size).sum(axis=0), Q), above_sh)
+    return _map_shares(lambda v: mod_array(v[:-1] - v[1:], Q), counts_sh)
+
+def _integers(values, name):
+    '''Returns public values as an array of integers, and rejects anything else (e.g. floats, which would be truncated).'''
+    arr = np.asarray(values)
+    assert arr.dtype.kind in 'iu' or (arr.dtype.kind == 'O' and all(isinstance(v, int) for v in arr.flat)), \
+        f'{name} must be integers, not {arr.dtype} (e.g. encode floats with fixed_point first)'
+    return arr
@@ -27,6 +27,34 @@
 # Alternatively, you can also directly use _share_bitwise() and _private_compare()
 # from this module on unshared integers to generate fresh bitwise shares.
 
+# Shared comparison note:
+#
+# To compare two SharedScalars (x > y), we don't reconstruct anything. Instead, we compute
+# the most significant bit of y - x, which is 1 exactly when y - x < 0 (as long as y - x
+# fits in an int64). This is a variant of ComputeMSB in SecureNN [2], for the int64 ring:
+#   1) A third machine P2 (the dealer) picks a random mask x, and shares it, and also 
+#      bitwise shares its low L-1 bits.
+#   2) We open r = a + x, which is uniformly random, so it doesn't reveal a.
+#   3) Since a = r - x, bit L-1 of a is r_{L-1} ^ x_{L-1} ^ (the borrow from the low bits),
+#      and the borrow is [x_low > r_low], which is exactly what PrivateCompare computes.
+#   4) PrivateCompare only tells P2 β' = β ^ [x_low > r_low], where β is random and unknown to
+#      P2. So P2 can share β' ^ x_{L-1}, and the other machines XOR in r_{L-1} ^ β (public to them).
+# The result is a SharedScalar of 0 or 1, which can be used in further arithmetic, e.g. for
+# ReLU(a) = a * (1 - msb(a)), or to select the larger of two values: y + [x > y] * (x - y).
+#
+# The maximum (and argmax) of n values is a tournament: each round compares adjacent pairs
+# of the remaining values in one batch (as a SharedTensor), and keeps the larger of each pair,
+# so it takes ceil(log2(n)) rounds of comparisons instead of n - 1.
+#
+# [2] Algorithm 5 in https://eprint.iacr.org/2018/442.pdf
+
+# Batching note:
+#
+# greater_than_batch() is the same algorithm for a whole SharedTensor at once. Each 
+# machine holds its bitwise shares of all n values as one (n, L) array, so every line of
+# the algorithm is a few array operations (e.g. the sum of w[i+1:] becomes a suffix sum
+# along the bit axis), and all n*L values of d are reconstructed in a single round.
+
 # Small hack:
 #
 # In the other shared_* modules, we use the `type(sh)` hack. However,
@@ -37,13 +65,17 @@
 # (Dependency-wise, these functions should really be part of tinysmpc.py, 
 #  but it's so much cleaner to split them out.)
 
-from .finite_ring import MIN_INT64
-from .secret_sharing import Share
-from random import random, randint, shuffle
+from .executor import kernel_map
+from .finite_ring import MIN_INT64, from_ring_array, mod, np, rand_array, rand_elements, to_ring_array
+from .profiler import profiled
+from .secret_sharing import Share, TensorShare
+from random import Random
 
 P = 67  # Smaller prime field size to encode bit values
 L = 64  # Number of bits of the integers we're using
+LOW_BITS = 2**(L-1) - 1  # Mask of the low L-1 bits (everything but the most significant bit)
 
+@profiled('greater_than')
 def greater_than(x_sh, pub):
     '''Provides the high-level API for comparing x_sh (SharedScalar) > pub (int).
        This basically does some TinySMPC-specific setup before calling PrivateCompare.'''
@@ -65,16 +97,24 @@ def greater_than(x_sh, pub):
 
 def _private_compare(x_sh, r, β=None):
     '''Compares x_sh > r, where x_sh is bitwise shared and r is a public integer.
-       Returns 0 or 1 as a PrivateScalar on a temporary VirtualMachine.
+       Returns 0 or 1 as a PrivateScalar on a temporary VirtualMachine.'''
+    from .tinysmpc import PrivateScalar, VirtualMachine
+    p2 = VirtualMachine('p2')
+    β, β_prime = _private_compare_masked(x_sh, r, p2, β)
+    return PrivateScalar(β ^ β_prime, p2)
+
+def _private_compare_masked(x_sh, r, p2, β=None):
+    '''Compares x_sh > r, where x_sh is bitwise shared and r is a public integer.
+       Returns β (known to x_sh's machines) and β' (known to p2), where β ^ β' = (x > r).
        This is the PrivateCompare algorithm in [1].'''
     # A necessary evil; see the "small hack" note above
-    from .tinysmpc import PrivateScalar, SharedScalar, VirtualMachine
+    from .tinysmpc import SharedScalar
 
     # Decompose r into its bit representation (public)
     rb = _get_bits(r)
     
     # Common randomness (public)
-    β = randint(0, 1) if β is None else β
+    β = rand_elements(1, 2)[0] if β is None else β
     s = _randlist()
     u = _randlist()
     π = _fixed_shuffle()
@@ -89,6 +129,7 @@ def _private_compare(x_sh, r, β=None):
            p1: {'w': [None] * L, 'c': [None] * L}}
     for j, machine in enumerate([p0, p1]):  
         w, c = w_c[machine]['w'], w_c[machine]['c']
+        w_sum = 0  # sum(w[i+1:])
         
         # Line 3
         for i in range(L-1, -1, -1):
@@ -97,12 +138,12 @@ def _private_compare(x_sh, r, β=None):
             # Line 4
             if β == 0:
                 w[i] = sh + j*rb[i] - 2*rb[i]*sh
-                c[i] = j*rb[i] - sh + j + sum(w[i+1:])
+                c[i] = j*rb[i] - sh + j + w_sum
 
             # Line 7
             elif (β == 1) and (r != 2**L - 1):
                 w[i] = sh + j*tb[i] - 2*tb[i]*sh
-                c[i] = -1*j*tb[i] + sh + j + sum(w[i+1:])
+                c[i] = -1*j*tb[i] + sh + j + w_sum
 
             # Line 10
             else:  
@@ -110,6 +151,9 @@ def _private_compare(x_sh, r, β=None):
                 else: c_val = ((-1)**j * u[i]) % P
                 c[i] = Share(c_val, machine, Q=P)
 
+            # Keep a running sum of w[i:], instead of re-summing w[i+1:] for every i
+            if w[i] is not None: w_sum = w_sum + w[i]
+
     # Line 14
     d_p0 = [s[i] * w_c[p0]['c'][i] for i in range(L)]
     d_p1 = [s[i] * w_c[p1]['c'][i] for i in range(L)]
@@ -117,18 +161,206 @@ def _private_compare(x_sh, r, β=None):
     d_shared = [SharedScalar([d0, d1], Q=P) for d0, d1 in zip(d_p0, d_p1)]
     
     # Line 15
-    p2 = VirtualMachine('p2')
     d = [d_sh.reconstruct(p2) for d_sh in d_shared]
-    β_prime = any(ps.value == 0 for ps in d)  # (we break the abstraction of only operating on PrivateScalars a bit)
+    β_prime = int(any(ps.value == 0 for ps in d))  # (we break the abstraction of only operating on PrivateScalars a bit)
         
-    # Return x > r
-    return PrivateScalar(β ^ β_prime, p2)    
+    # x > r is β ^ β'
+    return β, β_prime
     
-def _share_bitwise(n, machines):
-    '''Split integer n into bitwise secret shares, returns a list of SharedScalars (one per bit).'''
+@profiled('greater_than_batch')
+def greater_than_batch(x_sh, pub):
+    '''Provides the batched API for comparing x_sh (SharedTensor) > pub (int, or array of ints), elementwise.
+       Like greater_than, this does some TinySMPC-specific setup before calling (batched) PrivateCompare.'''
+    assert len(x_sh.owners) == 2, 'PrivateCompare only works for 2-party shares'
+    assert x_sh.Q is None or x_sh.Q <= 2**63, 'PrivateCompare only works for int64s'
+
+    # Reconstruct the private values on a temporary VM (see the Security Note above)
+    from .tinysmpc import VirtualMachine
+    tmp_vm = VirtualMachine('tmp_vm')
+    x = x_sh.reconstruct(tmp_vm).value
+
+    # Shift all int64s into the positive range, as uint64s (int64 + -MIN_INT64, which keeps their order)
+    x = to_ring_array(x) ^ np.uint64(-MIN_INT64)
+    r = to_ring_array(np.broadcast_to(pub, x.shape)) ^ np.uint64(-MIN_INT64)
+
+    # Decompose each x into its bit representation, and share all of the bits at once
+    x_sh = _share_bitwise_batch(x, list(x_sh.owners))
+
+    return _private_compare_batch(x_sh, r)
+
+def bitwise_shares(x_sh, cache=False):
+    '''Returns the bitwise shares of a SharedScalar (or SharedTensor), shifted into uint64s like in greater_than_batch,
+       as a SharedTensor of shape (*x_sh.shape, L) in the size-P ring. With cache, they're kept on x_sh and reused by
+       later calls, so that x_sh can be compared with many public values (at the cost of keeping L times as many shares).'''
+    cached = getattr(x_sh, '_bitwise_shares', None)
+    if cached is not None: return cached
+    assert len(x_sh.owners) == 2, 'PrivateCompare only works for 2-party shares'
+    assert x_sh.Q is None or x_sh.Q <= 2**63, 'PrivateCompare only works for int64s'
+
+    # Reconstruct the private values on a temporary VM (see the Security Note above)
+    from .tinysmpc import VirtualMachine
+    tmp_vm = VirtualMachine('tmp_vm')
+    x = x_sh.reconstruct(tmp_vm).value
+
+    # Decompose each x into its bit representation, and share all of the bits at once
+    x = to_ring_array(x) ^ np.uint64(-MIN_INT64)
+    bits_sh = _share_bitwise_batch(x, list(x_sh.owners))
+    if cache: x_sh._bitwise_shares = bits_sh
+    return bits_sh
+
+def _private_compare_batch(x_sh, r, β=None):
+    '''Compares x_sh > r elementwise, where x_sh is a bitwise shared SharedTensor of shape (..., L), 
+       and r is a public uint64 array of shape (...). Returns 0s and 1s as a PrivateTensor on a temporary 
+       VirtualMachine.'''
+    from .tinysmpc import PrivateTensor, VirtualMachine
+    p2 = VirtualMachine('p2')
+    β, β_prime = _private_compare_batch_masked(x_sh, r, p2, β)
+    return PrivateTensor(β ^ β_prime, p2)
+
+def _private_compare_batch_masked(x_sh, r, p2, β=None):
+    '''Compares x_sh > r elementwise, like _private_compare_batch. Returns the arrays β (known to x_sh's machines) 
+       and β' (known to p2), where β ^ β' = (x > r). This is _private_compare_masked, vectorized over the batch and the bits.'''
+    from .tinysmpc import SharedTensor
+
+    # Flatten the batch, so that every array below has shape (n,) or (n, L)
+    shape = r.shape
+    r = r.reshape(-1)
+    n = r.size
+
+    # Decompose r into its bit representation (public)
+    rb = _get_bits_array(r)
+
+    # Common randomness (public), one set per comparison
+    β = rand_array(n, 2) if β is None else np.broadcast_to(β, n)
+    s = rand_array((n, L), P-1) + 1
+    u = rand_array((n, L), P-1) + 1
+    π = np.argsort(rand_array((n, L)), axis=1)
+
+    # Line 1
+    t = r + np.uint64(1)
+    tb = _get_bits_array(t)
+
+    # Lines 4 and 7 are the same computation, with different bits (and signs) 
+    line_4 = (β == 0)
+    line_7 = (β == 1) & (r != np.uint64(2**L - 1))
+    line_10 = ~line_4 & ~line_7
+    bits = np.where(line_4[:, None], rb, tb)
+    sign = np.where(line_4, -1, 1)[:, None]
+
+    # Line 2 (each machine computes on its own shares, in parallel with a PartyExecutor)
+    p0, p1 = tuple(x_sh.owners)
+    shs = [x_sh.share_of[machine].value.reshape(n, L) for machine in (p0, p1)]
+    ds = kernel_map(_private_compare_party, shs, (0, 1), *([arg] * 2 for arg in (bits, sign, line_10, s, u, π)), size=n*L)
+    d_shared = SharedTensor([TensorShare(d, machine, Q=P) for d, machine in zip(ds, (p0, p1))], Q=P)
+
+    # Line 15 (a single reconstruction for the whole batch)
+    d = d_shared.reconstruct(p2)
+    β_prime = (d.value == 0).any(axis=1).astype(np.int64)  # (we break the abstraction of only operating on PrivateTensors a bit)
+
+    # x > r is β ^ β'
+    return β.reshape(shape), β_prime.reshape(shape)
+
+def _private_compare_party(sh, j, bits, sign, line_10, s, u, π):
+    '''Lines 3-14 of PrivateCompare, for machine j's (n, L) array of bit shares. Returns its (n, L) array of d shares.'''
+    # Lines 4, 7 (all bits at once, using a suffix sum for sum(w[i+1:]))
+    w = (sh + j*bits - 2*bits*sh) % P
+    w_sum = np.cumsum(w[:, ::-1], axis=1)[:, ::-1] - w
+    c = (sign*(sh - j*bits) + j + w_sum) % P
+
+    # Line 10
+    c_10 = ((1 - j)*(u + 1) - j*u) % P
+    c_10[:, 1] = ((-1)**j * u[:, 1]) % P
+    c = np.where(line_10[:, None], c_10, c)
+
+    # Line 14
+    d = (s * c) % P
+    return np.take_along_axis(d, π, axis=1)
+
+@profiled('msb')
+def msb(a_sh):
+    '''Computes the most significant bit of a SharedScalar (or SharedTensor, elementwise) in the int64 ring, i.e. a < 0.
+       Returns 0s and 1s that stay secret-shared on a_sh's machines (see the Shared Comparison Note above).'''
+    assert len(a_sh.owners) == 2, 'PrivateCompare only works for 2-party shares'
+    assert a_sh.Q is None, 'Shared comparison only works in the int64 ring'
+    from .tinysmpc import PrivateScalar, PrivateTensor, VirtualMachine
+    machines = list(a_sh.owners)
+    p2 = VirtualMachine('p2')
+
+    if hasattr(a_sh, 'shape'):
+        # P2 picks random masks x, and shares them, and the bits of their low L-1 bits
+        x = rand_array(a_sh.shape)
+        x_sh = PrivateTensor(from_ring_array(x), p2).share(machines)
+        x_low_sh = _share_bitwise_batch(x & np.uint64(LOW_BITS), machines, dealer=p2)
+
+        # Open r = a + x (public), and compare the low bits
+        r = to_ring_array((a_sh + x_sh).open())
+        β, β_prime = _private_compare_batch_masked(x_low_sh, r & np.uint64(LOW_BITS), p2)
+
+        # a_{L-1} = (r_{L-1} ^ β) ^ (x_{L-1} ^ β'), where P2 shares the second half
+        s_sh = PrivateTensor(β_prime ^ (x >> np.uint64(L-1)).astype(np.int64), p2).share(machines)
+        k = (r >> np.uint64(L-1)).astype(np.int64) ^ β
+    else:
+        x = rand_elements(1)[0] % 2**L
+        x_sh = PrivateScalar(mod(x), p2).share(machines)
+        x_low_sh = _share_bitwise(x & LOW_BITS, machines, dealer=p2)
+
+        r = (a_sh + x_sh).open() % 2**L
+        β, β_prime = _private_compare_masked(x_low_sh, r & LOW_BITS, p2)
+
+        s_sh = PrivateScalar(β_prime ^ (x >> (L-1)), p2).share(machines)
+        k = (r >> (L-1)) ^ β
+
+    # XOR the public bit k into the shared bit s: k ^ s = k + (1 - 2k) * s
+    return (1 - 2*k) * s_sh + k
+
+@profiled('greater_than_2sh')
+def greater_than_2sh(x_sh, y_sh):
+    '''Compares x_sh > y_sh for two SharedScalars (or SharedTensors, elementwise), without reconstructing them.
+       Returns 0s and 1s that stay secret-shared. This is correct as long as y - x fits in an int64.'''
+    x_sh._assert_can_operate(y_sh)
+    return msb(y_sh - x_sh)
+
+@profiled('relu')
+def relu(sh):
+    '''Computes max(sh, 0) of a SharedScalar (or SharedTensor, elementwise), with one MSB and one multiplication.'''
+    return sh * (1 - msb(sh))
+
+@profiled('max_sh')
+def max_sh(sh, with_index=False):
+    '''Computes the maximum of a SharedTensor along its last axis (and the index of the first maximum, if with_index),
+       with a tournament of ceil(log2(n)) rounds of batched comparisons (see the Shared Comparison Note above).'''
+    n = sh.shape[-1]
+    assert n > 0, 'Cannot take the maximum of no values'
+
+    # Keep the values (and their indices) as rows of one SharedTensor, so they're selected together
+    rows = [sh, sh * 0 + np.arange(n)] if with_index else [sh]
+    cur = _map_shares(lambda *values: np.stack(values), *rows)
+    while cur.shape[-1] > 1:
+        m = cur.shape[-1] // 2
+        left = _map_shares(lambda v: v[..., 0:2*m:2], cur)
+        right = _map_shares(lambda v: v[..., 1:2*m:2], cur)
+        rest = _map_shares(lambda v: v[..., 2*m:], cur)
+
+        # Keep the left value of each pair if it's >= the right one (so ties go to the first index)
+        keep_left = 1 - msb(_map_shares(lambda v: v[0], left) - _map_shares(lambda v: v[0], right))
+        winners = right + keep_left * (left - right)
+        cur = _map_shares(lambda v, w: np.concatenate([v, w], axis=-1), winners, rest)
+
+    res = [_map_shares(lambda v: v[i, ..., 0], cur) for i in range(len(rows))]
+    return tuple(res) if with_index else res[0]
+
+def _map_shares(fn, *shs):
+    '''Applies a local array function to each machine's TensorShares of some SharedTensors (e.g. to slice or stack them).'''
+    first = shs[0]
+    return type(first)([TensorShare(fn(*[sh.share_of[share.owner].value for sh in shs]), share.owner, first.Q)
+                        for share in first.shares], first.Q)
+
+def _share_bitwise(n, machines, dealer=None):
+    '''Split integer n into bitwise secret shares, returns a list of SharedScalars (one per bit).
+       dealer is the machine that knows n (by default, the first machine).'''
     from .tinysmpc import PrivateScalar
     bits = _get_bits(n)
-    ps_bits = [PrivateScalar(bit, machines[0]) for bit in bits]
+    ps_bits = [PrivateScalar(bit, dealer or machines[0]) for bit in bits]
     sh_bits = [ps_bit.share(machines, P) for ps_bit in ps_bits]
     return sh_bits
 
@@ -138,11 +370,20 @@ def _get_bits(n):
     bits = '0' * (L - len(bits)) + bits
     return list(map(int, reversed(bits)))  # FYI: the paper requires reversed binary, but doesn't say this!
 
+def _share_bitwise_batch(x, machines, dealer=None):
+    '''Split a uint64 array x into bitwise secret shares, returns a SharedTensor of shape (*x.shape, L).'''
+    from .tinysmpc import PrivateTensor
+    return PrivateTensor(_get_bits_array(x), dealer or machines[0]).share(machines, P)
+
+def _get_bits_array(x):
+    '''Returns the (reverse) binary representation of each value in a uint64 array, as an (*x.shape, L) array.'''
+    return ((x[..., None] >> np.arange(L, dtype=np.uint64)) & np.uint64(1)).astype(np.int64)
+
 def _randlist():
     '''Returns a list of L random integers in [1, P-1].'''
-    return [randint(1, P-1) for _ in range(L)]
+    return [value + 1 for value in rand_elements(L, P-1)]
 
 def _fixed_shuffle():
     '''Returns a deterministic shuffle function that always permutes a list in the same way.'''
-    seed = random()
-    return lambda x: shuffle(x, lambda: seed)
\ No newline at end of file
+    seed = rand_elements(1)[0]
+    return lambda x: Random(seed).shuffle(x)
\ No newline at end of file
@@ -1,6 +1,12 @@
 # This module defines multiplication on SharedScalars, using the SPDZ 
 # algorithm for multiplication [1].
 #
+# Each multiplication consumes a shared Beaver triple, and each squaring a square pair.
+# Matrix multiplications consume a matrix triple (A, B, C = A @ B), so they're one SPDZ
+# multiplication for the whole matrix product, instead of one per scalar product.
+# Triples are created on the fly, unless there's an active TriplePool with precomputed
+# triples (see triple_pool.py).
+#
 # [1] https://bristolcrypto.blogspot.com/2016/10/what-is-spdz-part-2-circuit-evaluation.html
 
 # Small hack:
@@ -13,42 +19,165 @@
 # we can use `type(sh)` to get access to the SharedScalar class &
 # constructor.
 
-from .finite_ring import mod, rand_element
-from .secret_sharing import n_to_shares
-from random import choice
+from .executor import party_map
+from .finite_ring import from_ring_array, matmul_array, mod, mod_array, np, rand_array, rand_elements, to_ring_array
+from .profiler import profiled
+from .secret_sharing import Share, TensorShare, n_to_shares, tensor_to_shares
+from .triple_pool import active_pool
 
+@profiled('mult_2sh')
 def mult_2sh(sh1, sh2):
     '''Implements multiplication on two SharedScalars.'''
     # Make sure that these two SharedScalars are compatible 
     sh1._assert_can_operate(sh2)
     
-    # Generate a random multiplication triple (public)
-    a, b = rand_element(sh1.Q), rand_element(sh1.Q)
-    c = mod(a * b, sh1.Q)
+    # Get a random multiplication triple, shared across all machines
+    shared_a, shared_b, shared_c = _shared_triple(sh1)
 
-    # Share the triple across all machines
-    # (It'd be nicer to use the higher-level PrivateScalar.share() here, 
-    # but we don't have access to PrivateScalar in this module.)
-    machines = list(sh1.owners)
-    shared_a = type(sh1)(n_to_shares(a, machines, sh1.Q), sh1.Q)
-    shared_b = type(sh1)(n_to_shares(b, machines, sh1.Q), sh1.Q)
-    shared_c = type(sh1)(n_to_shares(c, machines, sh1.Q), sh1.Q)
+    # Compute and open sh1 - a, sh2 - b (public), in the same round
+    sh1_m_a, sh2_m_b = _open_together(sh1 - shared_a, sh2 - shared_b)
 
-    # Compute sh1 - a, sh2 - b (shared)
-    shared_sh1_m_a = sh1 - shared_a
-    shared_sh2_m_b = sh2 - shared_b
+    # Magic! Compute each machine's share of the product
+    shared_prod = shared_c + (sh1_m_a * shared_b) + (sh2_m_b * shared_a) + (sh1_m_a * sh2_m_b)
+    return shared_prod
 
-    # Reconstruct sh1 - a, sh2 - b (public)
-    rand_machine = choice(machines)
-    sh1_m_a = shared_sh1_m_a.reconstruct(rand_machine).value
-    sh2_m_b = shared_sh2_m_b.reconstruct(rand_machine).value
+@profiled('mult_2tsh')
+def mult_2tsh(sh1, sh2):
+    '''Implements elementwise multiplication on two SharedTensors.
+       This is exactly mult_2sh, but with one (array) triple for the whole batch.'''
+    sh1._assert_can_operate(sh2)
+
+    # Get an array of random multiplication triples, shared across all machines
+    shared_a, shared_b, shared_c = _shared_tensor_triple(sh1, sh2)
+
+    # Compute and open sh1 - a, sh2 - b (public), in the same round
+    sh1_m_a, sh2_m_b = _open_together(sh1 - shared_a, sh2 - shared_b)
 
     # Magic! Compute each machine's share of the product
     shared_prod = shared_c + (sh1_m_a * shared_b) + (sh2_m_b * shared_a) + (sh1_m_a * sh2_m_b)
     return shared_prod
 
+@profiled('matmul_2tsh')
+def matmul_2tsh(sh1, sh2):
+    '''Implements matrix multiplication (sh1 @ sh2, with NumPy's rules) on two SharedTensors.
+       This is mult_2sh, but with a matrix triple (A, B, C = A @ B): we open E = sh1 - A and F = sh2 - B
+       together, and sh1 @ sh2 = C + E @ B + A @ F + E @ F. So an (m x k) @ (k x n) product opens m*k + k*n
+       values in one round, instead of m*k*n values for m*k*n separate mult_2sh's.'''
+    sh1._assert_can_operate(sh2)
+
+    # Get a random matrix multiplication triple, shared across all machines
+    shared_a, shared_b, shared_c = _shared_matrix_triple(sh1, sh2)
+
+    # Compute and open sh1 - A, sh2 - B (public), in the same round
+    sh1_m_a, sh2_m_b = _open_together(sh1 - shared_a, sh2 - shared_b)
+
+    # Magic! Compute each machine's share of the product
+    prod_m_ab = from_ring_array(matmul_array(to_ring_array(sh1_m_a, sh1.Q), to_ring_array(sh2_m_b, sh1.Q), sh1.Q), sh1.Q)
+    shared_prod = shared_c + matmul_pub_sh(sh1_m_a, shared_b) + matmul_sh_pub(shared_a, sh2_m_b) + prod_m_ab
+    return shared_prod
+
+@profiled('matmul_sh_pub')
+def matmul_sh_pub(sh, pub):
+    '''Implements matrix multiplication (sh @ pub) on a SharedTensor and a public array.'''
+    # Matrix multiplication is linear, so each machine just multiplies its own share
+    return type(sh)(party_map(lambda share: share @ pub, sh.shares), sh.Q)
+
+@profiled('matmul_pub_sh')
+def matmul_pub_sh(pub, sh):
+    '''Implements matrix multiplication (pub @ sh) on a public array and a SharedTensor.'''
+    return type(sh)(party_map(lambda share: pub @ share, sh.shares), sh.Q)
+
+@profiled('square_sh')
+def square_sh(sh):
+    '''Implements squaring of a SharedScalar (or SharedTensor).
+       This is mult_2sh(sh, sh), but with a square pair (a, a**2) instead of a triple, so only sh - a is opened:
+       sh**2 = (sh - a + a)**2 = a**2 + 2*(sh - a)*a + (sh - a)**2.'''
+    shared_a, shared_a2 = _shared_square(sh)
+    sh_m_a = (sh - shared_a).open()
+    return shared_a2 + (2 * sh_m_a * shared_a) + (sh_m_a * sh_m_a)
+
+@profiled('mult_sh_pub')
 def mult_sh_pub(sh, pub):
     '''Implements multiplication on a SharedScalar and a public integer.'''
-    # To do the multiplication, we multiply the integer with all shares
-    prod_shares = [share * pub for share in sh.shares]
-    return type(sh)(prod_shares, Q=sh.Q)
\ No newline at end of file
+    # To do the multiplication, we multiply the integer with all shares (in parallel, with a PartyExecutor)
+    prod_shares = party_map(lambda share: share * pub, sh.shares)
+    return type(sh)(prod_shares, Q=sh.Q)
+
+def _shared_triple(sh):
+    '''Returns a multiplication triple (a, b, c = a*b) as SharedScalars on the same machines as sh.
+       If there's an active TriplePool, the triple was precomputed in the offline phase. Otherwise, we make it now.'''
+    machines = list(sh.owners)
+    pool = active_pool(machines, sh.Q)
+    if pool is not None:
+        triple_of = pool.take(1)
+        return tuple(type(sh)([Share(int(from_ring_array(triple_of[m][i], sh.Q)[0]), m, sh.Q) for m in machines], sh.Q)
+                     for i in range(3))
+
+    # Generate a random multiplication triple (public)
+    a, b = rand_elements(2, sh.Q)
+    c = mod(a * b, sh.Q)
+
+    # Share the triple across all machines
+    # (It'd be nicer to use the higher-level PrivateScalar.share() here, 
+    # but we don't have access to PrivateScalar in this module.)
+    shared_a = type(sh)(n_to_shares(a, machines, sh.Q), sh.Q)
+    shared_b = type(sh)(n_to_shares(b, machines, sh.Q), sh.Q)
+    shared_c = type(sh)(n_to_shares(c, machines, sh.Q), sh.Q)
+    return shared_a, shared_b, shared_c
+
+def _shared_tensor_triple(sh1, sh2):
+    '''Returns arrays of multiplication triples (a, b, c = a*b) as SharedTensors, for multiplying sh1 * sh2.
+       If there's an active TriplePool (and no broadcasting), the triples were precomputed in the offline phase.'''
+    machines = list(sh1.owners)
+    pool = active_pool(machines, sh1.Q)
+    if pool is not None and sh1.shape == sh2.shape and 0 < sh1.size <= pool.capacity:
+        triple_of = pool.take(sh1.size)
+        return tuple(type(sh1)([TensorShare(triple_of[m][i].reshape(sh1.shape), m, sh1.Q) for m in machines], sh1.Q)
+                     for i in range(3))
+
+    # Generate random arrays of multiplication triples (public)
+    a, b = rand_array(sh1.shape, sh1.Q), rand_array(sh2.shape, sh1.Q)
+    c = mod_array(a * b, sh1.Q)
+
+    # Share the triples across all machines
+    shared_a = type(sh1)(tensor_to_shares(a, machines, sh1.Q), sh1.Q)
+    shared_b = type(sh1)(tensor_to_shares(b, machines, sh1.Q), sh1.Q)
+    shared_c = type(sh1)(tensor_to_shares(c, machines, sh1.Q), sh1.Q)
+    return shared_a, shared_b, shared_c
+
+def _shared_square(sh):
+    '''Returns a square pair (a, a**2) as SharedScalars (or SharedTensors) on the same machines as sh.'''
+    machines = list(sh.owners)
+    if hasattr(sh, 'shape'):
+        a = rand_array(sh.shape, sh.Q)
+        return (type(sh)(tensor_to_shares(a, machines, sh.Q), sh.Q),
+                type(sh)(tensor_to_shares(mod_array(a * a, sh.Q), machines, sh.Q), sh.Q))
+    a, = rand_elements(1, sh.Q)
+    return type(sh)(n_to_shares(a, machines, sh.Q), sh.Q), type(sh)(n_to_shares(mod(a * a, sh.Q), machines, sh.Q), sh.Q)
+
+def _shared_matrix_triple(sh1, sh2):
+    '''Returns a matrix multiplication triple (A, B, C = A @ B) as SharedTensors, for multiplying sh1 @ sh2.'''
+    machines = list(sh1.owners)
+    a, b = rand_array(sh1.shape, sh1.Q), rand_array(sh2.shape, sh1.Q)
+    c = matmul_array(a, b, sh1.Q)
+    return tuple(type(sh1)(tensor_to_shares(x, machines, sh1.Q), sh1.Q) for x in (a, b, c))
+
+def _open_together(*shared):
+    '''Open SharedScalars/SharedTensors (of any shapes, over the same machines and ring) in a single round,
+       by sending each machine's shares as one. Returns their public values (integers, or arrays).'''
+    from .tinysmpc import SharedTensor
+    if np is None: return [sh.open() for sh in shared]  # (only SharedScalars exist without NumPy)
+    first = shared[0]
+    for sh in shared[1:]: first._assert_can_operate(sh)
+    machines = list(first.owners)
+    joined = SharedTensor([TensorShare(np.concatenate([to_ring_array(sh.share_of[m].value, first.Q).reshape(-1) for sh in shared]), m, first.Q)
+                           for m in machines], first.Q)
+    values, start = joined.open(), 0
+    opened = []
+    for sh in shared:
+        shape = getattr(sh, 'shape', None)
+        size = sh.size if shape is not None else 1
+        part = values[start:start + size]
+        opened.append(part.reshape(shape) if shape is not None else part.tolist()[0])
+        start += size
+    return opened
@@ -0,0 +1,77 @@
+# This module defines powers and polynomials of SharedScalars (and SharedTensors),
+# e.g. for approximating activation functions like sigmoid or exp.
+#
+# Multiplying in a loop, x**n takes n-1 multiplications, one after another (n-1 rounds).
+# Instead, we use square-and-multiply: we compute the squares x, x**2, x**4, ... (with
+# square_sh's protocol, which only opens one value), and then multiply the ones that we
+# need in a balanced tree. This takes about log2(n) rounds.
+#
+# For a polynomial, all of the powers x, x**2, ..., x**d share their squares and products,
+# and the multiplications of each layer are done in the same round, so it takes
+# about log2(d) rounds in total. Adding the terms up is free.
+#
+# Both are compiled into circuits (see circuit.py) once per exponent or list of coefficients.
+#
+#   shared_x.polyval([1, 0, -2, 5])  # x**3 - 2*x + 5
+#
+# Fixed-point coefficients (floats) are converted with fixed_point_coeffs (see fixed_point.py).
+# Note that the result has degree + 1 scaling factors, so it needs a ring large enough to hold them.
+#
+# In the int64 ring, use SharedFixed instead (shared_x.polyval([0.5, 1, 2]) on a SharedFixed):
+# the same circuits are evaluated on its binary fixed point value, with a truncation after each
+# layer of products (see truncate_all in shared_truncation.py), so x, x**2, ..., x**d all keep
+# one scaling factor. The coefficients are multiplied in with one more scaling factor, and the
+# sum is truncated once at the end.
+
+from .circuit import compile_circuit
+from .finite_ring import MAX_INT64
+from .fixed_point import PRECISION, fixed_point_coeffs, to_fixed
+from .shared_truncation import truncate, truncate_all
+from functools import lru_cache
+
+def pow_sh(sh, n):
+    '''Implements sh ** n, for a public integer n > 0, with log2(n) rounds of multiplications.'''
+    assert isinstance(n, int) and n > 0
+    return _pow_circuit(n)(sh)
+
+def polyval_sh(sh, coeffs):
+    '''Evaluates a polynomial with public coefficients (highest degree first, like numpy.polyval) on sh.
+       If any coefficient is a float, they're all converted to fixed point (see fixed_point_coeffs).'''
+    assert len(coeffs) > 0
+    if any(isinstance(coeff, float) for coeff in coeffs):
+        max_value = MAX_INT64 if sh.Q is None else sh.Q // 2
+        assert 10**(PRECISION * len(coeffs)) <= max_value, \
+            f'{len(coeffs)} scaling factors of fixed point coefficients don\'t fit in the ring (use SharedFixed.polyval instead)'
+        coeffs = fixed_point_coeffs(coeffs)
+    assert all(isinstance(coeff, int) for coeff in coeffs)
+    res = _polyval_circuit(tuple(coeffs))(sh)
+    return res if not isinstance(res, int) else sh * 0 + res  # (if it's a constant polynomial)
+
+def pow_fixed(sh, n, frac_bits):
+    '''Implements sh ** n for the binary fixed point value of a SharedFixed, truncating after each layer of products.'''
+    assert isinstance(n, int) and n > 0
+    return _pow_circuit(n)(sh, rescale=lambda products: truncate_all(products, frac_bits))
+
+def polyval_fixed(sh, coeffs, frac_bits):
+    '''Evaluates a polynomial with public float (or integer) coefficients on the binary fixed point value of a SharedFixed.'''
+    assert len(coeffs) > 0
+    coeffs, degree = [float(coeff) for coeff in coeffs], len(coeffs) - 1
+    constant = to_fixed(coeffs[-1], 2 * frac_bits)  # (with the same two scaling factors as the other terms)
+    if degree == 0: return sh * 0 + to_fixed(coeffs[-1], frac_bits)
+    powers = _powers_circuit(degree)(sh, rescale=lambda products: truncate_all(products, frac_bits))
+    powers = powers if degree > 1 else [powers]
+    res = sum((to_fixed(coeff, frac_bits) * power for coeff, power in zip(coeffs[-2::-1], powers)), constant)
+    return truncate(res, frac_bits)
+
+@lru_cache(maxsize=256)
+def _pow_circuit(n):
+    return compile_circuit(lambda x: x**n)
+
+@lru_cache(maxsize=256)
+def _polyval_circuit(coeffs):
+    degree = len(coeffs) - 1
+    return compile_circuit(lambda x: sum(coeff * x**(degree - i) if i < degree else coeff for i, coeff in enumerate(coeffs)))
+
+@lru_cache(maxsize=256)
+def _powers_circuit(degree):
+    return compile_circuit(lambda x: [x**k for k in range(1, degree + 1)])
@@ -0,0 +1,80 @@
+# This module defines truncation on SharedScalars and SharedTensors in the int64 ring,
+# i.e. dividing a shared value by 2**f (rounding down, give or take 1), which SharedFixed
+# uses to rescale after each multiplication.
+#
+# With two machines, truncation is free: each machine just shifts its own share [1].
+#   - machine 0 computes x0 >> f, and machine 1 computes -((-x1) >> f)
+#     (as unsigned 64-bit shifts, i.e. on the bit patterns of the int64s)
+# Since x0 is uniformly random, this is correct (up to an error of 1 in the last bit)
+# except with probability about |x| / 2**63, so it's fine for values much smaller than
+# the ring (e.g. with |x| < 2**40, it fails with probability < 2**-22).
+#
+# With more machines, local shifts don't work, so we use a truncation pair (r, r >> f)
+# from the dealer [2]: we open c = x - r, and compute (r >> f) + -((-c) >> f). This is the
+# same as the 2-machine case, where the "shares" of x are r (shared) and c (public).
+# It costs one round, and opens one value. truncate_all truncates many values in that one round
+# (e.g. all of the products of a layer of a circuit, see SharedFixed.polyval).
+#
+# [1] Section 4.1 of https://eprint.iacr.org/2017/396.pdf (SecureML)
+# [2] Section 5.1 of https://eprint.iacr.org/2018/403.pdf (ABY3)
+
+# Small hack:
+#
+# Like in shared_multiplication.py, we use `type(sh)` to construct new SharedScalars/SharedTensors.
+
+from .finite_ring import mod, np, rand_array, rand_elements, to_ring_array
+from .profiler import profiled
+from .secret_sharing import Share, TensorShare, n_to_shares, tensor_to_shares
+
+@profiled('truncate')
+def truncate(sh, f):
+    '''Implements truncation of a SharedScalar (or SharedTensor) in the int64 ring: sh / 2**f, rounded down (+/- 1).'''
+    assert sh.Q is None, 'Truncation only works in the int64 ring.'
+    if f == 0: return sh
+    if len(sh.shares) == 2:
+        share0, share1 = sh.shares
+        return type(sh)([_new_share(_shift(share0.value, f), share0),
+                         _new_share(_neg(_shift(_neg(share1.value), f)), share1)])
+
+    # Get a random truncation pair (r, r >> f), shared across all machines
+    shared_r, shared_r_shifted = _shared_truncation_pair(sh, f)
+
+    # Open c = sh - r (public), and finish the truncation like in the 2-machine case
+    return _finish_truncation(shared_r_shifted, (sh - shared_r).open(), f)
+
+@profiled('truncate_all')
+def truncate_all(shs, f):
+    '''Truncates a list of SharedScalars (or SharedTensors) in the int64 ring, like truncate, opening all of their masked values in one round.'''
+    from .scheduler import _open_all
+    if f == 0 or len(shs) == 0 or len(shs[0].shares) == 2: return [truncate(sh, f) for sh in shs]
+    pairs = [_shared_truncation_pair(sh, f) for sh in shs]
+    opened = _open_all([sh - shared_r for sh, (shared_r, _) in zip(shs, pairs)])
+    return [_finish_truncation(shared_r_shifted, c, f) for (_, shared_r_shifted), c in zip(pairs, opened)]
+
+def _finish_truncation(shared_r_shifted, c, f):
+    '''Returns the truncation of r + c, given the shared r >> f and the public c.'''
+    if isinstance(c, int): return shared_r_shifted + _neg(_shift(_neg(c), f))
+    return shared_r_shifted + _neg(_shift(_neg(to_ring_array(c)), f))
+
+def _shared_truncation_pair(sh, f):
+    '''Returns a truncation pair (r, r >> f) as SharedScalars (or SharedTensors) on the same machines as sh.'''
+    machines = list(sh.owners)
+    if hasattr(sh, 'shape'):
+        r = rand_array(sh.shape)
+        return type(sh)(tensor_to_shares(r, machines)), type(sh)(tensor_to_shares(_shift(r, f), machines))
+    r, = rand_elements(1)
+    return type(sh)(n_to_shares(r, machines)), type(sh)(n_to_shares(_shift(r, f), machines))
+
+def _shift(value, f):
+    '''Unsigned right shift of an int64 (or ring array), i.e. of its 64-bit pattern.'''
+    if isinstance(value, int): return mod((value % 2**64) >> f)
+    return value >> np.uint64(f)
+
+def _neg(value):
+    '''Negation of an int64 (or ring array), in the int64 ring.'''
+    if isinstance(value, int): return mod(-value)
+    return 0 - value
+
+def _new_share(value, share):
+    '''Returns a new Share (or TensorShare) with a value, on the same machine as share.'''
+    return (TensorShare if isinstance(share, TensorShare) else Share)(value, share.owner)
@@ -1,27 +1,54 @@
 # This is TinySMPC's top-level module that defines its user-facing API:
 # the three classes VirtualMachine, PrivateScalar, and SharedScalar.
 #
+# PrivateTensor and SharedTensor are the batched versions of PrivateScalar and
+# SharedScalar: each machine holds one NumPy array of shares, so arithmetic costs 
+# a few array operations per batch, instead of a few Python objects per element.
+#
+# SharedFixed wraps a SharedScalar or SharedTensor that holds fixed point numbers,
+# and rescales them automatically after multiplications.
+#
 # For modularity, almost all of the behavior of these classes is implemented 
 # in functions imported from the other files here. Check them out!
 
-from .finite_ring import assert_is_element, mod, rand_element
-from .secret_sharing import n_from_shares, n_to_shares
+from .circuit import LazyValue
+from .fixed_point import FRAC_BITS, from_fixed, to_fixed
+from .finite_ring import assert_is_element, from_ring_array, mod, np, rand_element, to_ring_array
+from .object_store import ObjectStore
+from .opening import open_shares
+from .secret_sharing import Share, TensorShare, n_from_shares, n_to_shares, tensor_from_shares, tensor_to_shares
 from .shared_addition import add_2sh, add_sh_pub
-from .shared_comparison import greater_than
-from .shared_multiplication import mult_2sh, mult_sh_pub
+from .shared_bucketize import bucketize, histogram
+from .shared_comparison import greater_than, greater_than_2sh, greater_than_batch, max_sh, relu
+from .shared_multiplication import matmul_2tsh, matmul_pub_sh, matmul_sh_pub, mult_2sh, mult_2tsh, mult_sh_pub
+from .shared_polynomial import polyval_fixed, polyval_sh, pow_fixed, pow_sh
+from .shared_truncation import truncate
 
 class VirtualMachine():
     '''A very simple class that represents a machine's data. 
-       It just has a name and owns objects (PrivateScalars and Shares).'''
+       It just has a name and owns objects (PrivateScalars, PrivateTensors, Shares, and TensorShares).
+       The objects are tracked in an ObjectStore, which doesn't keep them alive (see object_store.py).'''
+    share_class = Share  # The class of the Shares that this machine owns
+
     def __init__(self, name):
         self.name = name
-        self.objects = []
+        self.objects = ObjectStore()
+
+    def scope(self):
+        '''Returns a Scope that keeps the objects created inside `with scope:` alive, until scope.release().'''
+        return self.objects.scope()
+
+    def footprint(self):
+        '''Returns the approximate memory used by this machine's objects, in bytes.'''
+        return self.objects.footprint()
     
     def __repr__(self):
         return f'VirtualMachine(\'{self.name}\')\n - ' + '\n - '.join(map(str, self.objects))
 
 class PrivateScalar():
     '''A class that represents a secret number that belongs to a machine.'''
+    __slots__ = ('value', 'owner', '__weakref__')
+
     def __init__(self, value, owner):
         self.value = value
         self.owner = owner
@@ -29,7 +56,7 @@ class PrivateScalar():
 
     def share(self, machines, Q=None):
         '''Split self.value into secret shares and distribute them across machines (tracked in a SharedScalar).'''
-        shares = n_to_shares(self.value, machines, Q)
+        shares = n_to_shares(self.value, machines, Q, dealer=self.owner)
         return SharedScalar(shares, Q)
     
     def __repr__(self):
@@ -45,10 +72,19 @@ class SharedScalar():
         self.owners = {share.owner for share in shares}
         self.Q = Q
         
-    def reconstruct(self, owner):
-        '''Send all shares to one machine, and reconstruct the hidden value as a PrivateScalar.'''
-        value = n_from_shares(self.shares, owner, self.Q)
+    def reconstruct(self, owner, strategy=None):
+        '''Send all shares to one machine, and reconstruct the hidden value as a PrivateScalar.
+           strategy is how the shares are sent (see opening.py), by default chosen by the number of machines.'''
+        value = n_from_shares(self.shares, owner, self.Q, strategy)
         return PrivateScalar(value, owner)
+
+    def open(self, strategy=None):
+        '''Open the hidden value to every machine (e.g. a masked value in a protocol), and return it as a public integer.'''
+        return open_shares(self.shares, self.Q, strategy)
+
+    def lazy(self):
+        '''Returns a LazyValue, so that operations on it build a circuit instead of running (see circuit.py).'''
+        return LazyValue('input', value=self)
         
     def __add__(self, other):
         '''Called by: self + other.'''
@@ -79,14 +115,38 @@ class SharedScalar():
     def __pow__(self, other):
         '''Called by: self ** other. Only implemented when other is a public integer > 0.'''
         assert isinstance(other, int) and other > 0
-        res = self
-        for _ in range(other-1): res *= self
-        return res
+        return pow_sh(self, other)
+
+    def polyval(self, coeffs):
+        '''Evaluate a polynomial with public coefficients (highest degree first) on this value, in O(log degree) rounds.'''
+        return polyval_sh(self, coeffs)
     
     def __gt__(self, other):
-        '''Called by: self > other. Only implemented when other is a public integer.'''
+        '''Called by: self > other (or other < self).
+           With a public integer, returns a PrivateScalar. With a SharedScalar, returns a SharedScalar of 0 or 1.'''
+        if isinstance(other, SharedScalar): return greater_than_2sh(self, other)
         assert isinstance(other, int)
         return greater_than(self, other)
+
+    def relu(self):
+        '''Returns max(self, 0) as a SharedScalar, without reconstructing anything.'''
+        return relu(self)
+
+    def bucketize(self, thresholds, one_hot=False, cache=False):
+        '''The number of sorted public thresholds below this value (its bucket index), as a SharedScalar,
+           or its one-hot bucket indicators as a SharedTensor, with all comparisons in one batch (see shared_bucketize.py).
+           With cache, this value keeps its bitwise shares, so later calls don't recompute them.'''
+        return bucketize(self, thresholds, one_hot, cache)
+
+    @staticmethod
+    def max(shared_scalars):
+        '''The maximum of a list of SharedScalars, in ceil(log2(n)) rounds of comparisons (see shared_comparison.py).'''
+        return max_sh(SharedTensor.stack(shared_scalars)).item()
+
+    @staticmethod
+    def argmax(shared_scalars):
+        '''The index of the (first) maximum of a list of SharedScalars, as a SharedScalar, like max.'''
+        return max_sh(SharedTensor.stack(shared_scalars), with_index=True)[1].item()
     
     def __repr__(self):
         return 'SharedScalar\n - ' + '\n - '.join(map(str, self.shares))
@@ -94,4 +154,256 @@ class SharedScalar():
     def _assert_can_operate(self, other):
         '''Assert that two SharedScalars have the same owners and rings.'''
         assert self.owners == other.owners, f'{self}\nand\n{other}\ndo not have the same owners.'
-        assert self.Q == other.Q, f'{self}\nand\n{other}\nare not over the same rings.'
\ No newline at end of file
+        assert self.Q == other.Q, f'{self}\nand\n{other}\nare not over the same rings.'
+
+class PrivateTensor():
+    '''A class that represents a secret array of numbers that belongs to a machine.'''
+    __slots__ = ('value', 'owner', '__weakref__')
+
+    def __init__(self, value, owner):
+        assert np is not None, 'PrivateTensors require NumPy.'
+        self.value = np.asarray(value)
+        self.owner = owner
+        owner.objects.append(self)
+
+    def share(self, machines, Q=None):
+        '''Split self.value into secret shares and distribute them across machines (tracked in a SharedTensor).'''
+        shares = tensor_to_shares(self.value, machines, Q, dealer=self.owner)
+        return SharedTensor(shares, Q)
+
+    def __repr__(self):
+        return f'PrivateTensor({self.value.tolist()}, \'{self.owner.name}\')'
+
+class SharedTensor():
+    '''A class that tracks all secret shares that corresponds to one PrivateTensor.
+       It supports *secure* elementwise arithmetic with other SharedTensors or public integers/arrays (+, -, *),
+       and matrix multiplication (@).'''
+    __array_ufunc__ = None  # Make NumPy defer to our operators, e.g. for: np.array(...) * self
+
+    def __init__(self, shares, Q=None):
+        assert all(share.Q == Q for share in shares)
+        self.shares = shares
+        self.share_of = {share.owner: share for share in shares}
+        self.owners = {share.owner for share in shares}
+        self.Q = Q
+
+    @property
+    def shape(self):
+        return self.shares[0].shape
+
+    @property
+    def size(self):
+        return self.shares[0].value.size
+
+    def reconstruct(self, owner, strategy=None):
+        '''Send all shares to one machine, and reconstruct the hidden array as a PrivateTensor (see SharedScalar.reconstruct).'''
+        value = tensor_from_shares(self.shares, owner, self.Q, strategy)
+        return PrivateTensor(value, owner)
+
+    def open(self, strategy=None):
+        '''Open the hidden array to every machine, and return it as a public array (see SharedScalar.open).'''
+        return open_shares(self.shares, self.Q, strategy)
+
+    def lazy(self):
+        '''Returns a LazyValue, so that operations on it build a circuit instead of running (see circuit.py).'''
+        return LazyValue('input', value=self)
+
+    @staticmethod
+    def stack(shared_scalars):
+        '''Combine a list of SharedScalars (over the same machines and ring) into a 1D SharedTensor.
+           Each machine just packs its own Shares into one TensorShare, so this is a local operation.'''
+        first = shared_scalars[0]
+        for sh in shared_scalars[1:]: first._assert_can_operate(sh)
+        shares = [TensorShare(to_ring_array([sh.share_of[share.owner].value for sh in shared_scalars], first.Q), share.owner, first.Q)
+                  for share in first.shares]
+        return SharedTensor(shares, first.Q)
+
+    def unstack(self):
+        '''Split a 1D SharedTensor into a list of SharedScalars (a local operation, like stack).'''
+        assert len(self.shape) == 1
+        values_of = {share.owner: from_ring_array(share.value, self.Q).tolist() for share in self.shares}
+        return [SharedScalar([Share(values_of[share.owner][i], share.owner, self.Q) for share in self.shares], self.Q)
+                for i in range(self.shape[0])]
+
+    def item(self):
+        '''Convert a SharedTensor with one element into a SharedScalar (a local operation, like unstack).'''
+        assert self.size == 1
+        return SharedScalar([Share(from_ring_array(share.value, self.Q).item(), share.owner, self.Q) for share in self.shares], self.Q)
+
+    def __add__(self, other):
+        '''Called by: self + other.'''
+        if _is_public(other):                 return add_sh_pub(self, other)
+        elif isinstance(other, SharedTensor): return add_2sh(self, other)
+
+    def __radd__(self, other):
+        '''Called by: other + self (when other is not a SharedTensor).'''
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        '''Called by: self - other.'''
+        if _is_public(other): other = np.asarray(other)
+        return self.__add__(-1*other)
+
+    def __rsub__(self, other):
+        '''Called by: other - self (when other is not a SharedTensor).'''
+        return (-1*self).__add__(other)
+
+    def __mul__(self, other):
+        '''Called by: self * other.'''
+        if _is_public(other):                 return mult_sh_pub(self, other)
+        elif isinstance(other, SharedTensor): return mult_2tsh(self, other)
+
+    def __rmul__(self, other):
+        '''Called by: other * self (when other is not a SharedTensor).'''
+        return self.__mul__(other)
+
+    def __matmul__(self, other):
+        '''Called by: self @ other (matrix multiplication, with NumPy's rules).
+           With fixed-point values, the result has one extra scaling factor, like *.'''
+        if _is_public(other):                 return matmul_sh_pub(self, np.asarray(other))
+        elif isinstance(other, SharedTensor): return matmul_2tsh(self, other)
+
+    def __rmatmul__(self, other):
+        '''Called by: other @ self (when other is a public array).'''
+        return matmul_pub_sh(np.asarray(other), self)
+
+    def dot(self, other):
+        '''The dot product of two vectors, or the matrix product of two matrices (see __matmul__).'''
+        return self.__matmul__(other)
+
+    def __pow__(self, other):
+        '''Called by: self ** other. Only implemented when other is a public integer > 0.'''
+        assert isinstance(other, int) and other > 0
+        return pow_sh(self, other)
+
+    def polyval(self, coeffs):
+        '''Evaluate a polynomial with public coefficients (highest degree first) on this value, in O(log degree) rounds.'''
+        return polyval_sh(self, coeffs)
+
+    def __gt__(self, other):
+        '''Called by: self > other (or other < self), elementwise.
+           With a public integer or array, returns a PrivateTensor. With a SharedTensor, returns a SharedTensor of 0s and 1s.'''
+        if isinstance(other, SharedTensor): return greater_than_2sh(self, other)
+        assert _is_public(other)
+        return greater_than_batch(self, other)
+
+    def relu(self):
+        '''Returns max(self, 0) elementwise, as a SharedTensor, without reconstructing anything.'''
+        return relu(self)
+
+    def bucketize(self, thresholds, one_hot=False, cache=False):
+        '''The bucket index of each value among sorted public thresholds, or its one-hot bucket indicators
+           (along a new last axis), as a SharedTensor (see SharedScalar.bucketize).'''
+        return bucketize(self, thresholds, one_hot, cache)
+
+    def histogram(self, edges, cache=False):
+        '''The number of values in each bin between sorted public edges (like np.histogram), as a SharedTensor.'''
+        return histogram(self, edges, cache)
+
+    def max(self):
+        '''The maximum along the last axis, in ceil(log2(n)) rounds of batched comparisons (see shared_comparison.py).'''
+        return max_sh(self)
+
+    def argmax(self):
+        '''The index of the (first) maximum along the last axis, as a SharedTensor, like max.'''
+        return max_sh(self, with_index=True)[1]
+
+    def __repr__(self):
+        return 'SharedTensor\n - ' + '\n - '.join(map(str, self.shares))
+
+    def _assert_can_operate(self, other):
+        '''Assert that two SharedTensors have the same owners and rings.'''
+        assert self.owners == other.owners, f'{self}\nand\n{other}\ndo not have the same owners.'
+        assert self.Q == other.Q, f'{self}\nand\n{other}\nare not over the same rings.'
+
+class SharedFixed():
+    '''A SharedScalar (or SharedTensor) in the int64 ring that holds a binary fixed point number, with frac_bits fractional bits.
+       It supports *secure* arithmetic with other SharedFixeds, or public numbers/arrays (+, -, *, @), and tracks the
+       scale automatically: every multiplication is followed by a truncation (see shared_truncation.py).'''
+    __array_ufunc__ = None  # Make NumPy defer to our operators, e.g. for: np.array(...) * self
+
+    def __init__(self, shared, frac_bits=FRAC_BITS):
+        assert shared.Q is None, 'SharedFixed only works in the int64 ring.'
+        self.shared = shared
+        self.frac_bits = frac_bits
+        self.owners = shared.owners
+
+    @staticmethod
+    def share(value, owner, machines, frac_bits=FRAC_BITS):
+        '''Encode a float (or array of floats) that belongs to owner, and split it into secret shares across machines.'''
+        private = PrivateScalar if isinstance(value, (int, float)) else PrivateTensor
+        return SharedFixed(private(to_fixed(value, frac_bits), owner).share(machines), frac_bits)
+
+    def reconstruct(self, owner, strategy=None):
+        '''Send all shares to one machine, and reconstruct the hidden float (or array of floats).'''
+        private = self.shared.reconstruct(owner, strategy)
+        return type(private)(from_fixed(private.value, self.frac_bits), owner)
+
+    def __add__(self, other):
+        '''Called by: self + other.'''
+        if isinstance(other, SharedFixed): return SharedFixed(self.shared + self._same_scale(other).shared, self.frac_bits)
+        return SharedFixed(self.shared + to_fixed(other, self.frac_bits), self.frac_bits)
+
+    def __radd__(self, other):
+        '''Called by: other + self (when other is not a SharedFixed).'''
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        '''Called by: self - other.'''
+        if isinstance(other, (list, tuple)): other = np.asarray(other)
+        return self.__add__(-1*other)
+
+    def __rsub__(self, other):
+        '''Called by: other - self (when other is not a SharedFixed).'''
+        return (-1*self).__add__(other)
+
+    def __mul__(self, other):
+        '''Called by: self * other. Multiplying by a public integer is exact; anything else is truncated.'''
+        if isinstance(other, SharedFixed): prod = self.shared * self._same_scale(other).shared
+        elif _is_public(other) and np.asarray(other).dtype.kind in 'iu': return SharedFixed(self.shared * other, self.frac_bits)
+        else: prod = self.shared * to_fixed(other, self.frac_bits)
+        return SharedFixed(truncate(prod, self.frac_bits), self.frac_bits)
+
+    def __rmul__(self, other):
+        '''Called by: other * self (when other is not a SharedFixed).'''
+        return self.__mul__(other)
+
+    def __matmul__(self, other):
+        '''Called by: self @ other (when self holds a SharedTensor).'''
+        if isinstance(other, SharedFixed): prod = self.shared @ self._same_scale(other).shared
+        else:                              prod = self.shared @ to_fixed(other, self.frac_bits)
+        return SharedFixed(truncate(prod, self.frac_bits), self.frac_bits)
+
+    def __rmatmul__(self, other):
+        '''Called by: other @ self (when other is a public array).'''
+        return SharedFixed(truncate(to_fixed(other, self.frac_bits) @ self.shared, self.frac_bits), self.frac_bits)
+
+    def __pow__(self, other):
+        '''Called by: self ** other. Only implemented when other is a public integer > 0 (truncated after each layer of products).'''
+        return SharedFixed(pow_fixed(self.shared, other, self.frac_bits), self.frac_bits)
+
+    def polyval(self, coeffs):
+        '''Evaluate a polynomial with public float coefficients (highest degree first) on this value, in O(log degree) rounds.'''
+        return SharedFixed(polyval_fixed(self.shared, coeffs, self.frac_bits), self.frac_bits)
+
+    def __gt__(self, other):
+        '''Called by: self > other. With a SharedFixed, the result stays secret-shared (see SharedScalar.__gt__).'''
+        if isinstance(other, SharedFixed): return self.shared > self._same_scale(other).shared
+        return self.shared > to_fixed(other, self.frac_bits)
+
+    def relu(self):
+        '''Returns max(self, 0), without reconstructing anything.'''
+        return SharedFixed(self.shared.relu(), self.frac_bits)
+
+    def __repr__(self):
+        return f'SharedFixed(frac_bits={self.frac_bits})\n - ' + '\n - '.join(map(str, self.shared.shares))
+
+    def _same_scale(self, other):
+        '''Assert that two SharedFixeds are compatible, and return other.'''
+        assert self.frac_bits == other.frac_bits, f'{self}\nand\n{other}\ndo not have the same precision.'
+        self.shared._assert_can_operate(other.shared)
+        return other
+
+def _is_public(value):
+    '''Returns whether value is a public integer or array of integers (that a SharedTensor can operate with).'''
+    return isinstance(value, (int, list, tuple)) or (np is not None and isinstance(value, (np.integer, np.ndarray)))
@@ -0,0 +1,155 @@
+# This module defines the offline phase of SPDZ multiplication [1]: generating
+# Beaver multiplication triples (a, b, c = a*b) ahead of time, in bulk.
+#
+# Multiplying two SharedScalars (or SharedTensors) consumes one shared triple per
+# element. By default, mult_2sh creates a fresh triple inside every multiplication,
+# so the triple generation sits on the critical path of the online computation.
+#
+# Instead, you can create a TriplePool for a group of machines and a ring. It keeps
+# a bounded store of already-shared triples, and refills it in large batches when it
+# drops below a low watermark (optionally in a background thread, e.g. during idle time).
+# While the pool is active, multiplications only consume triples from it:
+#
+#   with TriplePool([alice, bob], capacity=10000):
+#       shared_prod = shared_a * shared_b  # No triple generation here!
+#
+# [1] https://bristolcrypto.blogspot.com/2016/10/what-is-spdz-part-1-mpc-circuit-evaluation.html
+
+# Security note:
+#
+# Like mult_2sh, the pool generates its triples in the clear before sharing them
+# (i.e. it acts as a trusted dealer). Each machine only ever sees its own shares.
+
+from .finite_ring import mod_array, new_rng, np, rand_array
+from .secret_sharing import split_array
+from collections import deque
+from threading import Condition, Lock, Thread
+
+_active_pools = {}  # (frozenset of machines, Q) -> the TriplePool used by multiplications
+
+class TriplePool():
+    '''A bounded store of precomputed Beaver triples, secret shared across a group of machines.'''
+    def __init__(self, machines, Q=None, capacity=10000, low_watermark=None, batch_size=None, background=False):
+        assert np is not None, 'TriplePools require NumPy.'
+        assert len(machines) == len(set(machines))
+        self.machines = list(machines)
+        self.Q = Q
+        self.capacity = capacity
+        self.low_watermark = capacity // 4 if low_watermark is None else low_watermark
+        self.batch_size = capacity if batch_size is None else batch_size
+        assert 0 <= self.low_watermark < self.capacity and 0 < self.batch_size
+
+        # Each batch is (number of triples left, triple shares of each machine)
+        # where the triple shares are a dict of: machine -> (a, b, c) ring arrays
+        self._batches = deque()
+        self.available = 0
+        self.generated = 0
+        self._lock = Condition()
+        self._generating = Lock()  # Only one batch is generated at a time (also protects self._rng)
+        self._rng = new_rng()  # (seeded, if the randomness is, see seed_random)
+        self._closed = False
+        self._demand = 0  # How many triples a waiting take() needs
+        self._thread = None
+        if background:
+            self._thread = Thread(target=self._refill_forever, name='TriplePool', daemon=True)
+            self._thread.start()
+
+    def fill(self):
+        '''Generate triples until the pool is at capacity (this is the offline phase).'''
+        while self._generate_batch(): pass
+
+    def take(self, n=1):
+        '''Remove n shared triples from the pool. Returns a dict of: machine -> (a, b, c) ring arrays of size n.'''
+        assert n <= self.capacity, f'Cannot take {n} triples from a TriplePool with capacity {self.capacity}.'
+        assert not self._closed, 'Cannot take triples from a closed TriplePool.'
+        # Without a background thread, we refill synchronously (off the critical path when possible, see below)
+        if self._thread is None:
+            while self.available < n:
+                assert self._generate_batch() or not self._closed, 'Cannot take triples from a closed TriplePool.'
+
+        with self._lock:
+            while self.available < n:
+                assert not self._closed, 'Cannot take triples from a closed TriplePool.'  # (e.g. closed by another thread while we waited)
+                self._demand = n
+                self._lock.notify_all()
+                self._lock.wait()
+            self._demand = 0
+            parts = []
+            while n > 0:
+                n_left, triples_of = self._batches[0]
+                n_taken = min(n, n_left)
+                parts.append({m: tuple(arr[n_left-n_taken:n_left] for arr in triples_of[m]) for m in self.machines})
+                if n_taken == n_left: self._batches.popleft()
+                else: self._batches[0] = (n_left - n_taken, triples_of)
+                self.available -= n_taken
+                n -= n_taken
+            if self.available < self.low_watermark: self._lock.notify_all()
+
+        # Refill synchronously if we're not running in the background
+        if self._thread is None and self.available < self.low_watermark: self.fill()
+
+        if len(parts) == 1: return parts[0]
+        return {m: tuple(np.concatenate([part[m][i] for part in parts]) for i in range(3)) for m in self.machines}
+
+    def close(self):
+        '''Stop the background thread (if any), and remove all triples from the pool.'''
+        with self._lock:
+            self._closed = True
+            self._batches.clear()
+            self.available = 0
+            self._lock.notify_all()
+        if self._thread is not None: self._thread.join()
+        self.deactivate()
+
+    def activate(self):
+        '''Make multiplications on SharedScalars/SharedTensors over these machines and ring use this pool.'''
+        _active_pools[(frozenset(self.machines), self.Q)] = self
+        return self
+
+    def deactivate(self):
+        '''Make multiplications go back to creating fresh triples.'''
+        if _active_pools.get((frozenset(self.machines), self.Q)) is self:
+            del _active_pools[(frozenset(self.machines), self.Q)]
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, *exc):
+        self.deactivate()
+
+    def __repr__(self):
+        names = ', '.join(f'\'{m.name}\'' for m in self.machines)
+        return f'TriplePool([{names}], Q={self.Q}, available={self.available}, capacity={self.capacity})'
+
+    def _generate_batch(self):
+        '''Generate and share one batch of triples, if there's room for it. Returns whether it did.'''
+        with self._generating:
+            with self._lock:
+                n = min(self.batch_size, self.capacity - self.available)
+                if n <= 0 or self._closed: return False
+
+            # The expensive part runs without holding self._lock, so take() isn't blocked
+            a, b = rand_array(n, self.Q, self._rng), rand_array(n, self.Q, self._rng)
+            c = mod_array(a * b, self.Q)
+            shares_a, shares_b, shares_c = (split_array(x, len(self.machines), self.Q, self._rng) for x in (a, b, c))
+            triples_of = {m: (sa, sb, sc) for m, sa, sb, sc in zip(self.machines, shares_a, shares_b, shares_c)}
+
+            with self._lock:
+                if self._closed: return False
+                self._batches.append((n, triples_of))
+                self.available += n
+                self.generated += n
+                self._lock.notify_all()
+            return True
+
+    def _refill_forever(self):
+        '''Background thread: refill the pool whenever it drops below the low watermark.'''
+        while True:
+            with self._lock:
+                while not self._closed and self.available >= max(self.low_watermark, self._demand): self._lock.wait()
+                if self._closed: return
+            self.fill()
+
+def active_pool(machines, Q=None):
+    '''Returns the active TriplePool for this group of machines and ring, or None.'''
+    return _active_pools.get((frozenset(machines), Q))